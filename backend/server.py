@@ -1,38 +1,194 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Cookie
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Cookie, Query, WebSocket
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.middleware.gzip import GZipResponder
+from starlette.datastructures import Headers, MutableHeaders
 import os
 import logging
+import asyncio
+import codecs
+import gzip
+import hashlib
+import hmac
+import importlib.util
+import secrets
+import json
+import re
+import time
+import zlib
+from collections import OrderedDict, deque
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
-from openai import OpenAI
-import httpx
+from html import unescape
+from urllib.parse import urljoin, urlsplit
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB, LLM and HTTP clients are created on first use (see LAZY CLIENTS) to keep cold starts fast
+_mongo_client = None
+_db = None
+_http_client = None
+
+# Strong references to fire-and-forget tasks so they are not garbage collected
+_background_tasks = set()
 
 # A4F OpenAI Client
 A4F_API_KEY = os.environ.get('A4F_API_KEY')
 A4F_BASE_URL = os.environ.get('A4F_BASE_URL', 'https://api.a4f.co/v1')
 A4F_MODEL = os.environ.get('A4F_MODEL', 'provider-5/gpt-5-nano')
 
-if not A4F_API_KEY:
-    logging.error("A4F_API_KEY not set")
-else:
-    ai_client = OpenAI(api_key=A4F_API_KEY, base_url=A4F_BASE_URL)
+# LLM routing (hedged requests, fallback and circuit breaking across LLM_PROVIDERS)
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', '60'))
+LLM_HEDGE_MIN_SECONDS = float(os.environ.get('LLM_HEDGE_MIN_SECONDS', '2'))
+LLM_HEDGE_DEFAULT_SECONDS = float(os.environ.get('LLM_HEDGE_DEFAULT_SECONDS', '10'))
+LLM_STATS_WINDOW = 100
+LLM_BREAKER_FAILURES = int(os.environ.get('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_ERROR_RATE = 0.5
+LLM_BREAKER_COOLDOWN = float(os.environ.get('LLM_BREAKER_COOLDOWN', '30'))
+LLM_REPAIR_ATTEMPTS = 20
+
+# Outbound page fetches (proxy, reader mode, summarizer): per-origin limits and health
+FETCH_CONNECT_TIMEOUT = float(os.environ.get('FETCH_CONNECT_TIMEOUT', '4'))
+FETCH_READ_TIMEOUT = float(os.environ.get('FETCH_READ_TIMEOUT', '10'))
+FETCH_TOTAL_TIMEOUT = float(os.environ.get('FETCH_TOTAL_TIMEOUT', '20'))
+ORIGIN_MAX_CONCURRENCY = int(os.environ.get('ORIGIN_MAX_CONCURRENCY', '6'))
+ORIGIN_NEGATIVE_TTL = 15  # seconds to remember DNS failures and refused connections
+ORIGIN_BREAKER_FAILURES = 3
+ORIGIN_BREAKER_COOLDOWN = 30
+ORIGIN_STATS_WINDOW = 50
+ORIGIN_TRACKED_MAX = 2000
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+_CODE_FENCE_RE = re.compile(r'^```(?:json)?\s*|\s*```$')
+structured_output_stats = {}  # schema name -> counters for /api/llm/stats
+
+# Reader snapshot store (content-addressed, gzip-compressed blobs on local disk)
+SNAPSHOT_DIR = Path(os.environ.get('SNAPSHOT_DIR', ROOT_DIR / 'snapshots'))
+SNAPSHOT_REFRESH_AFTER = timedelta(hours=float(os.environ.get('SNAPSHOT_REFRESH_HOURS', '6')))
+SNAPSHOT_STORE_HTML = os.environ.get('SNAPSHOT_STORE_HTML', 'false').lower() == 'true'
+SNAPSHOT_GC_INTERVAL = 6 * 3600  # seconds between sweeps of blobs no snapshot references
+SNAPSHOT_GC_GRACE = 3600  # seconds a new blob is kept before its snapshot doc may exist
+
+# Response compression and compressed in-process caches
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+PROXY_CACHE_TTL = float(os.environ.get('PROXY_CACHE_TTL', '300'))
+PROXY_CACHE_ENTRIES = int(os.environ.get('PROXY_CACHE_ENTRIES', '200'))
+SUMMARY_CACHE_TTL = float(os.environ.get('SUMMARY_CACHE_TTL', '3600'))
+SUMMARY_CACHE_ENTRIES = int(os.environ.get('SUMMARY_CACHE_ENTRIES', '500'))
+
+# Delta sync
+TOMBSTONE_RETENTION = timedelta(days=int(os.environ.get('TOMBSTONE_RETENTION_DAYS', '30')))
+SYNC_CURSOR_SKEW = timedelta(seconds=2)
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', '1000'))  # per collection per /api/sync call
+CLEARED_ALL = "*"  # tombstone doc_id marking a whole-collection clear
+
+# Link prefetching (opt-in via settings.prefetch_links, only during a focus session)
+PREFETCH_LINKS = int(os.environ.get('PREFETCH_LINKS', '3'))
+PREFETCH_READER_LINKS = 1  # of those, how many also get a reader snapshot
+PREFETCH_READER_PER_HOUR = int(os.environ.get('PREFETCH_READER_PER_HOUR', '10'))  # per user; each one is an LLM call
+PREFETCH_MIN_SCORE = 0.2
+PREFETCH_CONCURRENCY = 2  # per user
+PREFETCH_BYTES_PER_MINUTE = int(os.environ.get('PREFETCH_BYTES_PER_MINUTE', str(5 * 1024 * 1024)))  # per user
+PREFETCH_MAX_PAGE_BYTES = 2 * 1024 * 1024
+PREFETCH_SCAN_CHARS = 500_000  # of page HTML searched for links
+PREFETCH_TRACKED_USERS = 5000
+_LINK_RE = re.compile(r'<a\s[^>]*?href\s*=\s*["\']([^"\'#]+)[^>]*>(.*?)</a>', re.IGNORECASE | re.DOTALL)
+_SKIP_LINK_RE = re.compile(r'\.(?:png|jpe?g|gif|svg|webp|ico|css|js|zip|gz|mp[34]|mov|avi|woff2?)(?:[?#]|$)', re.IGNORECASE)
+_URL_PATH_SEPARATORS_RE = re.compile(r'[/_\-.?=&]+')
+
+# Document extraction for reader mode and the summarizer (HTML, PDF, text, Markdown, JSON)
+SUMMARY_MAX_CHARS = 8000
+READER_MAX_CHARS = 50000
+DOCUMENT_HTML_MAX_CHARS = 2_000_000  # raw markup kept for the HTML extractors
+DOCUMENT_OFFLOAD_BYTES = 1024 * 1024  # larger bodies are parsed in a worker thread
+PDF_MAX_STREAM_BYTES = 16 * 1024 * 1024  # larger PDF streams are skipped, not buffered
+PDF_MAX_INFLATED_BYTES = 32 * 1024 * 1024
+PDF_FALLBACK_MAX_BYTES = 20 * 1024 * 1024  # kept for pypdf when it is installed
+HAVE_PYPDF = importlib.util.find_spec("pypdf") is not None
+_PDF_STREAM_RE = re.compile(rb'>>\s*stream(?:\r\n|\n|\r)')
+_PDF_SKIP_STREAM_RE = re.compile(rb'/(?:Image|FontFile\d?|Length1|ObjStm|XRef|XML|EmbeddedFile|DCTDecode|JPXDecode|CCITTFaxDecode|JBIG2Decode|LZWDecode)\b')
+# Strings and arrays stop at the next opener and numbers only start at a run's first digit, so
+# unterminated strings or long digit runs can't make each position rescan the rest of the stream
+_PDF_TEXT_OP_RE = re.compile(
+    rb'\((?:\\.|[^\\()])*\)\s*(?:Tj|\'|")'
+    rb'|\[(?:\\.|[^\\\[\]])*\]\s*TJ'
+    rb'|(?<![\d.-])(-?[\d.]{1,32})\s{1,64}(-?[\d.]{1,32})\s{1,64}T[dD]'
+    rb'|T\*|ET\b',
+    re.DOTALL
+)
+_PDF_STRING_RE = re.compile(rb'\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>|-?\d+(?:\.\d+)?', re.DOTALL)
+_PDF_ESCAPE_RE = re.compile(rb'\\([nrtbf()\\]|[0-7]{1,3}|\r?\n)')
+_PDF_TITLE_RE = re.compile(rb'/Title\s*\(((?:\\.|[^\\)]){1,300})\)')
+_MD_LINK_RE = re.compile(r'!?\[([^\]]*)\]\([^)]*\)')
+_MD_EMPHASIS_RE = re.compile(r'(\*\*|__|\*|_|`|~~)(?=\S)(.+?)(?<=\S)\1')
+_CHARSET_RE = re.compile(r'charset=([\w-]+)')
+_BLANK_LINE_RE = re.compile(r'\n\s*\n')
+
+# Activity analytics: per-user daily rollups kept up to date on write
+ACTIVITY_IDLE_CAP = 300  # seconds; longer gaps between visits count as time away
+ACTIVITY_SUMMARY_MAX_DAYS = 90
+ACTIVITY_TOP_DOMAINS = 10
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')  # stripped before matching words against a focus topic
+
+# Export/import of a user's whole data set as NDJSON
+EXPORT_FORMAT_VERSION = 1
+EXPORT_BATCH_SIZE = 500  # documents per Motor cursor batch
+EXPORT_CHUNK_SIZE = 64 * 1024  # bytes buffered before each write to the socket
+IMPORT_BATCH_SIZE = 500  # documents per bulk_write
+IMPORT_MAX_LINE = 16 * 1024 * 1024  # MongoDB's document size limit
+IMPORT_INFLATE_CHUNK = 256 * 1024  # most bytes inflated per step, so a gzip bomb can't balloon memory
+# Stored fields outside the API models that an import has to carry over (activity rollups read them)
+IMPORT_EXTRA_FIELDS = {"clips": ("session_id",), "history": ("session_id", "on_topic")}
+
+# Settings cache (per worker; change streams invalidate it across workers)
+SETTINGS_CACHE_TTL = float(os.environ.get('SETTINGS_CACHE_TTL', '60'))
+SETTINGS_CACHE_ENTRIES = 10000
+
+# Clip/note bodies: larger ones are stored zlib-compressed; list views read the preview
+BODY_COMPRESS_MIN_SIZE = 4096
+BODY_PREVIEW_CHARS = 200
+
+# Per-browser guest identities (signed guest_id cookie)
+GUEST_COOKIE = "guest_id"
+GUEST_ID_SECRET = os.environ.get('GUEST_ID_SECRET', '')
+GUEST_DATA_TTL = timedelta(days=int(os.environ.get('GUEST_DATA_TTL_DAYS', '30')))
+GUEST_TOUCH_INTERVAL = 3600  # seconds between last_seen_at updates per guest
+GUEST_PURGE_INTERVAL = 3600  # seconds between purges of abandoned guest data
+GUEST_DATA_COLLECTIONS = [
+    "workspaces", "clips", "notes", "tasks", "bookmarks", "browsing_history",
+    "focus_sessions", "page_summaries", "user_settings", "tombstones",
+    "activity_daily", "activity_state"
+]
+
+# Real-time change feed
+WS_QUEUE_SIZE = int(os.environ.get('WS_QUEUE_SIZE', '64'))
+
+# Precompiled HTML extraction patterns
+_SCRIPT_RE = re.compile(r'<script[^>]*>.*?</script>', re.DOTALL | re.IGNORECASE)
+_STYLE_RE = re.compile(r'<style[^>]*>.*?</style>', re.DOTALL | re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^>]+>')
+_TITLE_RE = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+_BOILERPLATE_RES = [
+    re.compile(rf'<{tag}[^>]*>.*?</{tag}>', re.DOTALL | re.IGNORECASE)
+    for tag in ('nav', 'footer', 'header', 'aside')
+]
+_ARTICLE_RE = re.compile(r'<article[^>]*>(.*?)</article>', re.IGNORECASE | re.DOTALL)
+_MAIN_RE = re.compile(r'<main[^>]*>(.*?)</main>', re.IGNORECASE | re.DOTALL)
+_BODY_RE = re.compile(r'<body[^>]*>(.*?)</body>', re.IGNORECASE | re.DOTALL)
+_BLOCK_RES = [
+    re.compile(rf'<{tag}[^>]*>(.*?)</{tag}>', re.IGNORECASE | re.DOTALL)
+    for tag in ('h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p')
+]
 
-# Create the main app
-app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
 # ============ MODELS ============
@@ -70,7 +226,21 @@ class Clip(BaseModel):
     url: Optional[str] = None
     title: Optional[str] = None
     tags: List[str] = []
+    preview: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class ClipPreview(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    clip_id: str
+    user_id: str
+    workspace_id: Optional[str] = None
+    url: Optional[str] = None
+    title: Optional[str] = None
+    tags: List[str] = []
+    preview: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
 
 class Note(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -79,9 +249,33 @@ class Note(BaseModel):
     workspace_id: Optional[str] = None
     content: str
     title: Optional[str] = None
+    preview: Optional[str] = None
+    version: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class NotePreview(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    note_id: str
+    user_id: str
+    workspace_id: Optional[str] = None
+    title: Optional[str] = None
+    preview: Optional[str] = None
+    version: int = 0
+    created_at: datetime
+    updated_at: datetime
+
+class TextEdit(BaseModel):
+    """Replace `delete` characters at `pos` (an offset into the base text) with `insert`"""
+    pos: int = Field(ge=0)
+    delete: int = Field(default=0, ge=0)
+    insert: str = ""
+
+class NotePatch(BaseModel):
+    base_version: int
+    edits: List[TextEdit] = []
+    title: Optional[str] = None
+
 class FocusSession(BaseModel):
     model_config = ConfigDict(extra="ignore")
     session_id: str = Field(default_factory=lambda: f"session_{uuid.uuid4().hex[:12]}")
@@ -94,6 +288,7 @@ class FocusSession(BaseModel):
     notes: List[str] = []
     recommendations: dict
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     status: str = "active"
 
 class Task(BaseModel):
@@ -105,6 +300,7 @@ class Task(BaseModel):
     completed: bool = False
     due_date: Optional[datetime] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class Bookmark(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -115,6 +311,7 @@ class Bookmark(BaseModel):
     favicon: Optional[str] = None
     tags: List[str] = []
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class BrowsingHistory(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -123,6 +320,41 @@ class BrowsingHistory(BaseModel):
     url: str
     title: str
     visited_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+# LLM output schemas
+
+class SessionTopic(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    title: str
+    keywords: List[dict] = []
+    phrases: List[str] = []
+    summarySeed: str = ""
+    tagSuggestions: List[str] = []
+
+class SessionPayload(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    sessionId: Optional[str] = None
+    topic: SessionTopic
+    localMatchingRules: dict = {}
+    synthTemplates: dict = {}
+    confidence: float = 0.0
+    notes: List[str] = []
+    recommendations: dict = {}
+
+class PageSummary(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    summary: str
+    keyPoints: List[str] = []
+    mainTopics: List[str] = []
+    takeaways: List[str] = []
+    wordCount: int = 0
+
+class ReaderContent(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    title: str = "Untitled"
+    content: str
+    summary: str = ""
 
 class UserSettings(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -131,8 +363,713 @@ class UserSettings(BaseModel):
     font_size: str = "medium"
     spacing_density: str = "comfortable"
     default_search_engine: str = "google"
+    prefetch_links: bool = False
+    version: int = 0
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# ============ LAZY CLIENTS ============
+
+def get_mongo_client():
+    global _mongo_client
+    if _mongo_client is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        _mongo_client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    return _mongo_client
+
+def get_db():
+    global _db
+    if _db is None:
+        _db = get_mongo_client()[os.environ['DB_NAME']]
+    return _db
+
+def get_http_client():
+    """Shared outbound HTTP client, so connections are pooled across requests"""
+    global _http_client
+    if _http_client is None:
+        import httpx
+        _http_client = httpx.AsyncClient()
+    return _http_client
+
+# ============ COMPRESSION HELPERS ============
+
+class BrotliResponder:
+    """Brotli counterpart of starlette's GZipResponder"""
+    def __init__(self, app, minimum_size: int):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.send = None
+        self.initial_message = {}
+        self.started = False
+        self.content_encoding_set = False
+        self.compressor = brotli.Compressor(quality=5)
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_with_brotli)
+
+    async def send_with_brotli(self, message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            self.initial_message = message
+            self.content_encoding_set = "content-encoding" in Headers(raw=message["headers"])
+        elif message_type == "http.response.body" and self.content_encoding_set:
+            if not self.started:
+                self.started = True
+                await self.send(self.initial_message)
+            await self.send(message)
+        elif message_type == "http.response.body" and not self.started:
+            self.started = True
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if len(body) < self.minimum_size and not more_body:
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+            headers = MutableHeaders(raw=self.initial_message["headers"])
+            headers["Content-Encoding"] = "br"
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+                message["body"] = self.compressor.process(body) + self.compressor.flush()
+            else:
+                message["body"] = self.compressor.process(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(message["body"]))
+            await self.send(self.initial_message)
+            await self.send(message)
+        elif message_type == "http.response.body":
+            body = self.compressor.process(message.get("body", b""))
+            if message.get("more_body", False):
+                message["body"] = body + self.compressor.flush()
+            else:
+                message["body"] = body + self.compressor.finish()
+            await self.send(message)
+
+def encoding_qvalue(accept_encoding: str, encoding: str) -> float:
+    """q-value the client's Accept-Encoding gives an encoding (0 when it is not acceptable)"""
+    wildcard = 0.0
+    for item in accept_encoding.split(","):
+        token, _, params = item.strip().partition(";")
+        token = token.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if token == encoding:
+            return q
+        if token == "*":
+            wildcard = q
+    return wildcard
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br or gzip by q-value (br wins ties); None for identity"""
+    gzip_q = encoding_qvalue(accept_encoding, "gzip")
+    br_q = encoding_qvalue(accept_encoding, "br") if brotli is not None else 0.0
+    if br_q > 0 and br_q >= gzip_q:
+        return "br"
+    if gzip_q > 0:
+        return "gzip"
+    return None
+
+class CompressionMiddleware:
+    """Negotiate br (when the brotli package is installed) or gzip for responses above minimum_size.
+
+    Responses that already carry a Content-Encoding (precompressed cache entries,
+    pass-through proxy bodies) are sent as-is.
+    """
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            encoding = negotiate_encoding(Headers(scope=scope).get("Accept-Encoding", ""))
+            if encoding == "br":
+                await BrotliResponder(self.app, self.minimum_size)(scope, receive, send)
+                return
+            if encoding == "gzip":
+                await GZipResponder(self.app, self.minimum_size, compresslevel=6)(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+class CompressedCache:
+    """Small in-process TTL/LRU cache whose entries are kept gzip-compressed"""
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Return (gzip_body, media_type) or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, gzip_body, media_type = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return gzip_body, media_type
+
+    def set(self, key, gzip_body: bytes, media_type: str):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, gzip_body, media_type)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+def decode_content_encoding(body: bytes, encoding: str) -> bytes:
+    """Undo a gzip/deflate Content-Encoding"""
+    if encoding == 'gzip':
+        return gzip.decompress(body)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+def gzip_response(request: Request, gzip_body: bytes, media_type: str, status_code: int = 200) -> Response:
+    """Serve a gzip-compressed body as-is when the client accepts gzip, otherwise inflate it"""
+    if encoding_qvalue(request.headers.get("Accept-Encoding", ""), "gzip") > 0:
+        return Response(
+            content=gzip_body,
+            media_type=media_type,
+            status_code=status_code,
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+        )
+    return Response(content=gzip.decompress(gzip_body), media_type=media_type, status_code=status_code)
+
+_proxy_cache = CompressedCache(PROXY_CACHE_ENTRIES, PROXY_CACHE_TTL)
+_summary_cache = CompressedCache(SUMMARY_CACHE_ENTRIES, SUMMARY_CACHE_TTL)
+
+# ============ ORIGIN HEALTH ============
+
+class OriginUnavailable(Exception):
+    """Raised without touching the network while an origin is known to be down"""
+    def __init__(self, origin: str, message: str, retry_after: int):
+        super().__init__(message)
+        self.origin = origin
+        self.retry_after = retry_after
+
+class ResponseTooLarge(Exception):
+    """Raised when a fetch with max_bytes exceeds it"""
+
+class OriginHealth:
+    """Concurrency cap, circuit breaker and negative cache for one scheme://host:port"""
+    def __init__(self, origin: str):
+        self.origin = origin
+        self.slots = asyncio.Semaphore(ORIGIN_MAX_CONCURRENCY)
+        self.in_flight = 0
+        self.latencies = deque(maxlen=ORIGIN_STATS_WINDOW)
+        self.outcomes = deque(maxlen=ORIGIN_STATS_WINDOW)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.unreachable_until = 0.0
+        self.unreachable_reason = None
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def check(self):
+        """Fail fast while the origin is negatively cached or its circuit is open"""
+        now = time.monotonic()
+        if now < self.unreachable_until:
+            raise OriginUnavailable(self.origin, self.unreachable_reason, int(self.unreachable_until - now) + 1)
+        if self.consecutive_failures >= ORIGIN_BREAKER_FAILURES:
+            if now < self.open_until or self.probing:
+                retry_after = int(max(self.open_until - now, 0)) + 1
+                raise OriginUnavailable(self.origin, f"{self.origin} is failing; not retrying for now", retry_after)
+            # Half-open: let a single request through to probe the origin
+            self.probing = True
+
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        self.probing = False
+
+    def record_failure(self, unreachable_reason: Optional[str] = None):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        self.probing = False
+        if unreachable_reason:
+            self.unreachable_until = time.monotonic() + ORIGIN_NEGATIVE_TTL
+            self.unreachable_reason = unreachable_reason
+        if self.consecutive_failures >= ORIGIN_BREAKER_FAILURES:
+            self.open_until = time.monotonic() + ORIGIN_BREAKER_COOLDOWN
+            logging.warning(f"Origin {self.origin} circuit open for {ORIGIN_BREAKER_COOLDOWN}s")
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "origin": self.origin,
+            "requests": len(self.outcomes),
+            "errorRate": round(self.error_rate(), 3),
+            "p50LatencyMs": round(p50 * 1000) if p50 is not None else None,
+            "p95LatencyMs": round(p95 * 1000) if p95 is not None else None,
+            "inFlight": self.in_flight,
+            "circuitOpen": self.consecutive_failures >= ORIGIN_BREAKER_FAILURES and now < self.open_until,
+            "unreachable": self.unreachable_reason if now < self.unreachable_until else None
+        }
+
+# origin -> OriginHealth, least recently used first
+_origins = OrderedDict()
+
+def origin_health(url: str) -> OriginHealth:
+    parts = urlsplit(url)
+    origin = f"{parts.scheme}://{parts.netloc.lower()}"
+    health = _origins.get(origin)
+    if health is None:
+        health = _origins[origin] = OriginHealth(origin)
+        while len(_origins) > ORIGIN_TRACKED_MAX:
+            _origins.popitem(last=False)
+    _origins.move_to_end(origin)
+    return health
+
+async def fetch_page(url: str, headers: dict, raw: bool = False, max_bytes: Optional[int] = None, consume=None):
+    """GET a page through the origin health layer; returns (response, body).
+
+    With raw=True the body is the undecoded bytes from the wire; otherwise it
+    is None and the response has been read, so .text/.content are available.
+    max_bytes (raw only) aborts larger transfers with ResponseTooLarge.
+    consume, an async callable taking the streaming response, replaces both:
+    its result becomes the body and it may stop reading early.
+    """
+    import httpx
+    
+    health = origin_health(url)
+    health.check()
+    client = get_http_client()
+    timeout = httpx.Timeout(FETCH_READ_TIMEOUT, connect=FETCH_CONNECT_TIMEOUT, pool=FETCH_CONNECT_TIMEOUT)
+    
+    async def send():
+        resp = await client.send(client.build_request("GET", url, headers=headers, timeout=timeout), stream=True, follow_redirects=True)
+        try:
+            if consume is not None:
+                return resp, await consume(resp)
+            if raw:
+                if max_bytes is not None and int(resp.headers.get("content-length") or 0) > max_bytes:
+                    raise ResponseTooLarge(url)
+                chunks = []
+                size = 0
+                async for chunk in resp.aiter_raw():
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise ResponseTooLarge(url)
+                    chunks.append(chunk)
+                return resp, b"".join(chunks)
+            await resp.aread()
+            return resp, None
+        finally:
+            await resp.aclose()
+    
+    try:
+        await asyncio.wait_for(health.slots.acquire(), FETCH_CONNECT_TIMEOUT)
+    except asyncio.TimeoutError:
+        health.probing = False
+        raise OriginUnavailable(health.origin, f"Too many concurrent requests to {health.origin}", 1)
+    health.in_flight += 1
+    started = time.monotonic()
+    try:
+        # The read timeout applies per chunk, so also cap the whole transfer
+        resp, body = await asyncio.wait_for(send(), FETCH_TOTAL_TIMEOUT)
+    except asyncio.TimeoutError:
+        health.record_failure()
+        raise httpx.ReadTimeout(f"{url} did not finish within {FETCH_TOTAL_TIMEOUT}s")
+    except httpx.ConnectError as e:
+        # DNS failures and refused connections will not fix themselves in the next few seconds
+        health.record_failure(unreachable_reason=f"Could not connect to {health.origin}: {e}")
+        raise
+    except httpx.TransportError:
+        health.record_failure()
+        raise
+    finally:
+        # Cancellations and unexpected errors must not leave a half-open probe claimed
+        health.probing = False
+        health.in_flight -= 1
+        health.slots.release()
+    
+    if resp.status_code >= 500:
+        health.record_failure()
+    else:
+        health.record_success(time.monotonic() - started)
+    return resp, body
+
+# ============ LLM PROVIDER ROUTER ============
+
+class LLMProvider:
+    """One OpenAI-compatible endpoint/model pair with rolling latency and error stats"""
+    def __init__(self, name: str, base_url: str, api_key: str, model: str, json_mode: bool = False):
+        self.name = name
+        self.model = model
+        self.json_mode = json_mode
+        self.base_url = base_url
+        self.api_key = api_key
+        self._client = None
+        self.latencies = deque(maxlen=LLM_STATS_WINDOW)
+        self.outcomes = deque(maxlen=LLM_STATS_WINDOW)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, timeout=LLM_TIMEOUT, max_retries=0)
+        return self._client
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < 5:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def hedge_deadline(self) -> float:
+        """Seconds to wait on this provider before sending a hedged request elsewhere"""
+        p95 = self.p95()
+        return max(LLM_HEDGE_MIN_SECONDS, p95) if p95 is not None else LLM_HEDGE_DEFAULT_SECONDS
+
+    def is_available(self) -> bool:
+        if not self.open_until:
+            return True
+        # Once the cooldown passes the breaker is half-open and one call decides its state
+        return time.monotonic() >= self.open_until and not self.probing
+
+    def begin_call(self) -> bool:
+        """Claim a call; False while the circuit is open or another call is probing it"""
+        if not self.is_available():
+            return False
+        if self.open_until:
+            self.probing = True
+        return True
+
+    def end_call(self):
+        # Also runs for calls cancelled before they started, which record nothing
+        self.probing = False
+
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    def record_cancelled(self, elapsed: float):
+        # Lost a hedge race: it would have taken at least this long, so a provider
+        # that turns slow stops looking fast even though it never finishes a call
+        self.latencies.append(elapsed)
+
+    def record_failure(self):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        self.probing = False
+        tripped = len(self.outcomes) >= 10 and self.error_rate() > LLM_BREAKER_ERROR_RATE
+        if self.consecutive_failures >= LLM_BREAKER_FAILURES or tripped:
+            self.open_until = time.monotonic() + LLM_BREAKER_COOLDOWN
+            logging.warning(f"LLM provider {self.name} circuit open for {LLM_BREAKER_COOLDOWN}s")
+
+    def stats(self) -> dict:
+        p95 = self.p95()
+        return {
+            "name": self.name,
+            "model": self.model,
+            "requests": len(self.outcomes),
+            "errorRate": round(self.error_rate(), 3),
+            "p95LatencyMs": round(p95 * 1000) if p95 is not None else None,
+            "circuitOpen": not self.is_available()
+        }
+
+class LLMRouter:
+    """Routes chat completions across providers with hedging, fallback and circuit breaking"""
+    def __init__(self, providers: List[LLMProvider]):
+        self.providers = providers
+
+    def ranked(self) -> List[LLMProvider]:
+        available = [p for p in self.providers if p.is_available()]
+        return sorted(available, key=lambda p: (p.error_rate(), p.p95() or LLM_HEDGE_DEFAULT_SECONDS))
+
+    async def _stream_json(self, provider: LLMProvider, messages: list, **kwargs) -> str:
+        """Stream a completion and stop reading once the first JSON object closes"""
+        if provider.json_mode:
+            kwargs.setdefault('response_format', {"type": "json_object"})
+        stream = await provider.client.chat.completions.create(
+            model=provider.model,
+            messages=messages,
+            stream=True,
+            **kwargs
+        )
+        scanner = JSONScanner()
+        parts = []
+        try:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                parts.append(delta)
+                scanner.feed(delta)
+                if scanner.complete:
+                    break
+        finally:
+            await stream.close()
+        return "".join(parts)
+
+    async def _call(self, provider: LLMProvider, messages: list, structured: bool = False, **kwargs) -> str:
+        started = time.monotonic()
+        try:
+            if structured:
+                text = await self._stream_json(provider, messages, **kwargs)
+            else:
+                response = await provider.client.chat.completions.create(
+                    model=provider.model,
+                    messages=messages,
+                    **kwargs
+                )
+                text = response.choices[0].message.content or ""
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            provider.record_failure()
+            raise
+        provider.record_success(time.monotonic() - started)
+        return text
+
+    async def complete(self, messages: list, structured: bool = False, **kwargs) -> str:
+        """Return the completion text from the first provider to answer.
+
+        The best-ranked provider is tried first; if it has not answered by its
+        p95-based deadline a hedged request goes to the next one, and errors fall
+        through to the next provider immediately. The slower request is cancelled.
+        """
+        candidates = self.ranked()
+        pending = {}
+        started = {}
+        next_index = 0
+        last_error = None
+        
+        def launch() -> Optional[LLMProvider]:
+            """Start a call on the next candidate that will take one, if any"""
+            nonlocal next_index
+            while next_index < len(candidates):
+                provider = candidates[next_index]
+                next_index += 1
+                if provider.begin_call():
+                    task = asyncio.create_task(self._call(provider, messages, structured, **kwargs))
+                    task.add_done_callback(lambda _, provider=provider: provider.end_call())
+                    pending[task] = provider
+                    started[task] = time.monotonic()
+                    return provider
+            return None
+        
+        first = launch()
+        if first is None:
+            raise HTTPException(status_code=503, detail="All LLM providers are unavailable")
+        deadline = first.hedge_deadline()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=deadline if next_index < len(candidates) else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedge = launch()
+                    if hedge is not None:
+                        deadline = hedge.hedge_deadline()
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        last_error = e
+                        logging.warning(f"LLM provider {provider.name} failed: {e}")
+                if not pending:
+                    fallback = launch()
+                    if fallback is not None:
+                        deadline = fallback.hedge_deadline()
+        finally:
+            for task, provider in pending.items():
+                task.cancel()
+                # Recorded now rather than when the task unwinds, so the next call already ranks by it
+                provider.record_cancelled(time.monotonic() - started[task])
+        raise HTTPException(status_code=502, detail=f"LLM request failed: {last_error}")
+
+def load_llm_providers() -> List[LLMProvider]:
+    """Providers from LLM_PROVIDERS (JSON list), defaulting to the A4F endpoint"""
+    configured = json.loads(os.environ.get('LLM_PROVIDERS', '[]'))
+    if not configured and A4F_API_KEY:
+        configured = [{"name": "a4f", "base_url": A4F_BASE_URL, "api_key": A4F_API_KEY, "model": A4F_MODEL}]
+    if not configured:
+        logging.error("A4F_API_KEY not set")
+    return [
+        LLMProvider(
+            name=p.get('name', p['base_url']),
+            base_url=p['base_url'],
+            api_key=p.get('api_key') or A4F_API_KEY,
+            model=p['model'],
+            json_mode=p.get('json_mode', False)
+        )
+        for p in configured
+    ]
+
+llm_router = LLMRouter(load_llm_providers())
+
+# ============ STRUCTURED LLM OUTPUT ============
+
+class StructuredOutputError(Exception):
+    """LLM output that could not be parsed or validated; keeps the raw text for debugging"""
+    def __init__(self, message: str, raw_response: str):
+        super().__init__(message)
+        self.raw_response = raw_response
+
+class JSONScanner:
+    """Incrementally tracks string and bracket state of streamed JSON text.
+
+    Finds where the first top-level object starts and ends, so a stream can be
+    cut off as soon as the object closes and a truncated one can be closed.
+    """
+    def __init__(self):
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.start = None
+        self.end = None
+        self.length = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def feed(self, chunk: str):
+        if self.end is None:
+            for i, ch in enumerate(chunk, self.length):
+                if self.start is None:
+                    if ch == '{':
+                        self.start = i
+                        self.stack.append(ch)
+                elif self.in_string:
+                    if self.escape:
+                        self.escape = False
+                    elif ch == '\\':
+                        self.escape = True
+                    elif ch == '"':
+                        self.in_string = False
+                elif ch == '"':
+                    self.in_string = True
+                elif ch in '{[':
+                    self.stack.append(ch)
+                elif ch in '}]':
+                    if self.stack:
+                        self.stack.pop()
+                    if not self.stack:
+                        self.end = i + 1
+                        break
+        self.length += len(chunk)
+
+def close_truncated_json(text: str) -> str:
+    """Close the open string, arrays and objects of a truncated JSON prefix"""
+    scanner = JSONScanner()
+    scanner.feed(text)
+    if scanner.start is None or scanner.complete:
+        return text
+    text = text[scanner.start:]
+    if scanner.in_string:
+        text = (text[:-1] if scanner.escape else text) + '"'
+    return text + ''.join('}' if c == '{' else ']' for c in reversed(scanner.stack))
+
+def parse_llm_json(text: str):
+    """Parse the first JSON object in LLM output, repairing common defects.
+
+    Handles markdown fences and surrounding prose, trailing commas and
+    truncated output. Returns (data, repaired).
+    """
+    scanner = JSONScanner()
+    scanner.feed(text)
+    if scanner.start is None:
+        raise json.JSONDecodeError("No JSON object found", text, 0)
+    if scanner.complete:
+        candidate = text[scanner.start:scanner.end]
+        try:
+            return json.loads(candidate), False
+        except json.JSONDecodeError:
+            return json.loads(_TRAILING_COMMA_RE.sub(r'\1', candidate)), True
+    
+    # Truncated: close what is open, dropping trailing partial members until it parses
+    prefix = text[scanner.start:]
+    for _ in range(LLM_REPAIR_ATTEMPTS):
+        try:
+            return json.loads(_TRAILING_COMMA_RE.sub(r'\1', close_truncated_json(prefix))), True
+        except json.JSONDecodeError as e:
+            error = e
+            cut = prefix.rstrip().rstrip(',').rfind(',')
+            if cut <= 0:
+                break
+            prefix = prefix[:cut]
+    raise error
+
+def strip_code_fences(text: str) -> str:
+    return _CODE_FENCE_RE.sub('', text.strip())
+
+async def generate_structured(prompt: str, schema):
+    """Run a JSON-producing prompt through the LLM router and validate it against schema.
+
+    Output is streamed and cut off as soon as the JSON object closes. If it was
+    truncated, one continuation prompt asks for the rest instead of redoing the
+    whole call. Raises StructuredOutputError when nothing valid can be recovered.
+    """
+    stats = structured_output_stats.setdefault(
+        schema.__name__, {"requests": 0, "repaired": 0, "continued": 0, "failures": 0}
+    )
+    stats["requests"] += 1
+    messages = [{"role": "user", "content": prompt}]
+    response_text = await llm_router.complete(messages, structured=True)
+    
+    scanner = JSONScanner()
+    scanner.feed(response_text)
+    if scanner.start is not None and not scanner.complete:
+        stats["continued"] += 1
+        continuation = await llm_router.complete(messages + [
+            {"role": "assistant", "content": response_text},
+            {"role": "user", "content": "Your JSON was cut off. Continue exactly where you stopped and output only the remaining JSON text."}
+        ])
+        response_text += strip_code_fences(continuation)
+    
+    try:
+        data, repaired = parse_llm_json(response_text)
+        result = schema.model_validate(data)
+    except (json.JSONDecodeError, ValidationError) as e:
+        stats["failures"] += 1
+        logging.error(f"Structured output error ({schema.__name__}): {e}. Response: {response_text[:500]}")
+        raise StructuredOutputError(str(e), response_text)
+    if repaired:
+        stats["repaired"] += 1
+    return result.model_dump()
+
+def structured_output_metrics() -> dict:
+    return {
+        name: {**stats, "parseFailureRate": round(stats["failures"] / stats["requests"], 3) if stats["requests"] else 0.0}
+        for name, stats in structured_output_stats.items()
+    }
+
 # ============ AUTH HELPERS ============
 
 async def get_current_user(request: Request, session_token: Optional[str] = Cookie(None)) -> Optional[User]:
@@ -149,7 +1086,7 @@ async def get_current_user(request: Request, session_token: Optional[str] = Cook
         print("DEBUG: No token found")
         return None
     
-    session_doc = await db.user_sessions.find_one({"session_token": token}, {"_id": 0})
+    session_doc = await get_db().user_sessions.find_one({"session_token": token}, {"_id": 0})
     if not session_doc:
         print(f"DEBUG: Session not found for token: {token}")
         return None
@@ -161,10 +1098,10 @@ async def get_current_user(request: Request, session_token: Optional[str] = Cook
         expires_at = expires_at.replace(tzinfo=timezone.utc)
     
     if expires_at < datetime.now(timezone.utc):
-        await db.user_sessions.delete_one({"session_token": token})
+        await get_db().user_sessions.delete_one({"session_token": token})
         return None
     
-    user_doc = await db.users.find_one({"user_id": session_doc["user_id"]}, {"_id": 0})
+    user_doc = await get_db().users.find_one({"user_id": session_doc["user_id"]}, {"_id": 0})
     if not user_doc:
         return None
     
@@ -184,11 +1121,141 @@ async def get_optional_user(request: Request, session_token: Optional[str] = Coo
     """Get user if authenticated, return None for guest mode"""
     return await get_current_user(request, session_token)
 
-def get_guest_user_id() -> str:
-    """Generate a consistent guest user ID based on session (or create one per browser session)"""
-    # For guest mode, we'll use a consistent guest ID
-    # In production, you might want to use session-based guest IDs
-    return "guest_user"
+async def load_guest_id_secret():
+    """Use GUEST_ID_SECRET, or else the one secret shared through Mongo by every worker and cold start"""
+    global GUEST_ID_SECRET
+    if GUEST_ID_SECRET:
+        return
+    # Concurrent first upserts on _id are retried by the server, so every caller reads the same value
+    doc = await get_db().app_config.find_one_and_update(
+        {"_id": "guest_id_secret"},
+        {"$setOnInsert": {"value": secrets.token_hex(32), "created_at": datetime.now(timezone.utc)}},
+        upsert=True,
+        return_document=True  # ReturnDocument.AFTER
+    )
+    GUEST_ID_SECRET = doc["value"]
+
+# guest_id -> monotonic time of the last last_seen_at write
+_guest_touched = OrderedDict()
+
+def sign_guest_id(guest_id: str) -> str:
+    if not GUEST_ID_SECRET:
+        # Loaded by verify_guest_cookie / get_guest_user_id before any guest id is minted or checked
+        raise RuntimeError("Guest id secret not loaded")
+    signature = hmac.new(GUEST_ID_SECRET.encode(), guest_id.encode(), hashlib.sha256).hexdigest()[:32]
+    return f"{guest_id}.{signature}"
+
+async def verify_guest_cookie(value: Optional[str]) -> Optional[str]:
+    """Return the guest id from a signed guest_id cookie, or None if missing or forged"""
+    if not value or '.' not in value:
+        return None
+    await load_guest_id_secret()
+    guest_id = value.rsplit('.', 1)[0]
+    return guest_id if hmac.compare_digest(sign_guest_id(guest_id), value) else None
+
+async def get_guest_user_id(request) -> str:
+    """Per-browser guest ID from the signed guest_id cookie, minting one if needed"""
+    guest_id = getattr(request.state, 'guest_user_id', None)
+    if guest_id is None:
+        guest_id = await verify_guest_cookie(request.cookies.get(GUEST_COOKIE))
+        if guest_id is None:
+            # GuestIdentityMiddleware signs and sets the cookie on the way out
+            await load_guest_id_secret()
+            guest_id = f"guest_{uuid.uuid4().hex[:16]}"
+            request.state.new_guest_user_id = guest_id
+        request.state.guest_user_id = guest_id
+        touch_guest(guest_id)
+    return guest_id
+
+def touch_guest(guest_id: str):
+    """Record guest activity (throttled) so abandoned guest data can expire"""
+    now = time.monotonic()
+    last = _guest_touched.get(guest_id)
+    if last is not None and now - last < GUEST_TOUCH_INTERVAL:
+        return
+    _guest_touched[guest_id] = now
+    _guest_touched.move_to_end(guest_id)
+    while len(_guest_touched) > 10000:
+        _guest_touched.popitem(last=False)
+    task = asyncio.create_task(get_db().guest_identities.update_one(
+        {"guest_id": guest_id},
+        {"$set": {"last_seen_at": datetime.now(timezone.utc)}},
+        upsert=True
+    ))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def merge_guest_data(guest_id: str, user_id: str):
+    """Move a guest's data into a signed-in user's partition"""
+    db = get_db()
+    for collection in GUEST_DATA_COLLECTIONS:
+        if collection == "user_settings":
+            # Keep the user's own settings if they already have some
+            if await db.user_settings.find_one({"user_id": user_id}, {"_id": 1}):
+                await db.user_settings.delete_one({"user_id": guest_id})
+                continue
+        if collection in ("activity_daily", "activity_state"):
+            # Rollups are one document per user and day; rebuilt below from the merged data
+            await db[collection].delete_many({"user_id": guest_id})
+            continue
+        await db[collection].update_many({"user_id": guest_id}, {"$set": {"user_id": user_id}})
+    await db.guest_identities.delete_one({"guest_id": guest_id})
+    _guest_touched.pop(guest_id, None)
+    invalidate_settings(guest_id)
+    invalidate_settings(user_id)
+    schedule_rollup_rebuild(user_id)
+
+async def purge_abandoned_guests():
+    """Delete data of guests not seen within GUEST_DATA_TTL"""
+    db = get_db()
+    cutoff = datetime.now(timezone.utc) - GUEST_DATA_TTL
+    async for identity in db.guest_identities.find({"last_seen_at": {"$lt": cutoff}}, {"_id": 0, "guest_id": 1}):
+        for collection in GUEST_DATA_COLLECTIONS:
+            await db[collection].delete_many({"user_id": identity["guest_id"]})
+        await db.guest_identities.delete_one({"guest_id": identity["guest_id"]})
+
+async def purge_abandoned_guests_periodically():
+    while True:
+        try:
+            await purge_abandoned_guests()
+        except Exception as e:
+            logging.error(f"Guest data purge failed: {e}")
+        await asyncio.sleep(GUEST_PURGE_INTERVAL)
+
+class GuestIdentityMiddleware:
+    """Sets the signed guest_id cookie when a request minted a new guest identity"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        async def send_with_guest_cookie(message):
+            if message["type"] == "http.response.start":
+                guest_id = scope.get("state", {}).get("new_guest_user_id")
+                if guest_id:
+                    headers = MutableHeaders(scope=message)
+                    headers.append(
+                        "set-cookie",
+                        f"{GUEST_COOKIE}={sign_guest_id(guest_id)}; Max-Age={int(GUEST_DATA_TTL.total_seconds())}; "
+                        "Path=/; HttpOnly; SameSite=lax"
+                    )
+            await send(message)
+        
+        await self.app(scope, receive, send_with_guest_cookie)
+
+async def record_tombstone(collection: str, user_id: str, doc_id: str):
+    """Remember a delete so /api/sync can report it to other clients"""
+    now = datetime.now(timezone.utc)
+    await get_db().tombstones.insert_one({
+        "collection": collection,
+        "doc_id": doc_id,
+        "user_id": user_id,
+        "deleted_at": now.isoformat(),
+        "purge_at": now + TOMBSTONE_RETENTION
+    })
 
 # ============ AUTH ENDPOINTS ============
 
@@ -200,24 +1267,23 @@ async def create_session(request: Request, response: Response):
         if not session_id:
             raise HTTPException(status_code=400, detail="X-Session-ID header required")
         
-        async with httpx.AsyncClient() as http_client:
-            auth_response = await http_client.get(
-                'https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data',
-                headers={'X-Session-ID': session_id},
-                timeout=10.0
-            )
-            
-            if auth_response.status_code != 200:
-                raise HTTPException(status_code=401, detail="Invalid session")
-            
-            auth_data = auth_response.json()
+        auth_response = await get_http_client().get(
+            'https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data',
+            headers={'X-Session-ID': session_id},
+            timeout=10.0
+        )
+        
+        if auth_response.status_code != 200:
+            raise HTTPException(status_code=401, detail="Invalid session")
+        
+        auth_data = auth_response.json()
         
         user_id = f"user_{uuid.uuid4().hex[:12]}"
-        existing_user = await db.users.find_one({"email": auth_data['email']}, {"_id": 0})
+        existing_user = await get_db().users.find_one({"email": auth_data['email']}, {"_id": 0})
         
         if existing_user:
             user_id = existing_user['user_id']
-            await db.users.update_one(
+            await get_db().users.update_one(
                 {"user_id": user_id},
                 {"$set": {
                     "name": auth_data['name'],
@@ -232,7 +1298,7 @@ async def create_session(request: Request, response: Response):
                 "picture": auth_data.get('picture'),
                 "created_at": datetime.now(timezone.utc).isoformat()
             }
-            await db.users.insert_one(user_doc)
+            await get_db().users.insert_one(user_doc)
         
         session_token = auth_data.get('session_token', f"session_{uuid.uuid4().hex}")
         session_doc = {
@@ -241,7 +1307,13 @@ async def create_session(request: Request, response: Response):
             "expires_at": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
             "created_at": datetime.now(timezone.utc).isoformat()
         }
-        await db.user_sessions.insert_one(session_doc)
+        await get_db().user_sessions.insert_one(session_doc)
+        
+        # Carry over anything this browser created as a guest
+        guest_id = await verify_guest_cookie(request.cookies.get(GUEST_COOKIE))
+        if guest_id:
+            await merge_guest_data(guest_id, user_id)
+            response.delete_cookie(key=GUEST_COOKIE, path="/")
         
         response.set_cookie(
             key="session_token",
@@ -253,7 +1325,7 @@ async def create_session(request: Request, response: Response):
             max_age=7 * 24 * 60 * 60
         )
         
-        user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+        user = await get_db().users.find_one({"user_id": user_id}, {"_id": 0})
         return {"user": user, "session_token": session_token}
         
     except Exception as e:
@@ -276,7 +1348,7 @@ async def logout(request: Request, response: Response, session_token: Optional[s
             token = auth_header.split(' ')[1]
     
     if token:
-        await db.user_sessions.delete_one({"session_token": token})
+        await get_db().user_sessions.delete_one({"session_token": token})
     
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Logged out"}
@@ -287,9 +1359,9 @@ async def logout(request: Request, response: Response, session_token: Optional[s
 async def session_init(request: Request, session_token: Optional[str] = Cookie(None)):
     """Initialize a focus session with AI (single call)"""
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
+    user_id = user.user_id if user else await get_guest_user_id(request)
     
-    if 'ai_client' not in globals():
+    if not llm_router.providers:
          raise HTTPException(status_code=503, detail="AI service not configured (A4F_API_KEY missing)")
 
     try:
@@ -335,21 +1407,7 @@ Topic to analyze: {topic_source}
 
 Remember: Return ONLY the JSON object, no other text."""
 
-        response = ai_client.chat.completions.create(
-            model=A4F_MODEL,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        
-        response_text = response.choices[0].message.content.strip()
-        
-        # Remove markdown code blocks if present
-        if response_text.startswith('```'):
-            lines = response_text.split('\n')
-            response_text = '\n'.join(lines[1:-1]) if len(lines) > 2 else response_text
-            response_text = response_text.replace('```json', '').replace('```', '').strip()
-        
-        import json
-        session_data = json.loads(response_text)
+        session_data = await generate_structured(prompt, SessionPayload)
         
         # Store in database
         session_doc = FocusSession(
@@ -365,15 +1423,17 @@ Remember: Return ONLY the JSON object, no other text."""
         
         doc = session_doc.model_dump()
         doc['created_at'] = doc['created_at'].isoformat()
-        await db.focus_sessions.insert_one(doc)
+        doc['updated_at'] = doc['updated_at'].isoformat()
+        await get_db().focus_sessions.insert_one(doc)
+        change_hub.publish("focus_sessions", "upsert", user_id, session_doc.session_id, session_doc.model_dump(mode='json'))
+        record_activity(user_id, session_doc.created_at, {"sessions": 1})
         
         return session_data
         
-    except json.JSONDecodeError as e:
-        logging.error(f"JSON parse error: {e}. Response: {response_text}")
+    except StructuredOutputError as e:
         return JSONResponse(
             status_code=400,
-            content={"error": "Failed to parse AI response", "raw_response": response_text[:500]}
+            content={"error": "Failed to parse AI response", "raw_response": e.raw_response[:500]}
         )
     except Exception as e:
         logging.error(f"Session init error: {e}")
@@ -381,11 +1441,8 @@ Remember: Return ONLY the JSON object, no other text."""
 
 # ============ WORKSPACE ENDPOINTS ============
 
-@api_router.get("/workspaces", response_model=List[Workspace])
-async def get_workspaces(request: Request, session_token: Optional[str] = Cookie(None)):
-    user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    workspaces = await db.workspaces.find({"user_id": user_id}, {"_id": 0}).to_list(1000)
+async def load_workspaces(user_id: str) -> list:
+    workspaces = await get_db().workspaces.find({"user_id": user_id}, {"_id": 0}).to_list(1000)
     for w in workspaces:
         if isinstance(w.get('created_at'), str):
             w['created_at'] = datetime.fromisoformat(w['created_at'])
@@ -393,278 +1450,1652 @@ async def get_workspaces(request: Request, session_token: Optional[str] = Cookie
             w['updated_at'] = datetime.fromisoformat(w['updated_at'])
     return workspaces
 
+@api_router.get("/workspaces", response_model=List[Workspace])
+async def get_workspaces(request: Request, session_token: Optional[str] = Cookie(None)):
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    return await load_workspaces(user_id)
+
 @api_router.post("/workspaces", response_model=Workspace)
 async def create_workspace(workspace: dict, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
+    user_id = user.user_id if user else await get_guest_user_id(request)
     ws = Workspace(user_id=user_id, **workspace)
     doc = ws.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     doc['updated_at'] = doc['updated_at'].isoformat()
-    await db.workspaces.insert_one(doc)
+    await get_db().workspaces.insert_one(doc)
     return ws
 
+# ============ CLIP & NOTE BODY STORAGE ============
+
+def make_preview(content: str) -> str:
+    text = " ".join(content.split())
+    if len(text) > BODY_PREVIEW_CHARS:
+        text = text[:BODY_PREVIEW_CHARS].rstrip() + "…"
+    return text
+
+def pack_body(content: str):
+    """Storage fields for a body: ($set fields, $unset fields)"""
+    fields = {"preview": make_preview(content)}
+    encoded = content.encode()
+    if len(encoded) >= BODY_COMPRESS_MIN_SIZE:
+        fields["content_z"] = zlib.compress(encoded)
+        return fields, {"content": ""}
+    fields["content"] = content
+    return fields, {"content_z": ""}
+
+def unpack_body(doc: dict) -> dict:
+    """Restore `content` on a stored clip/note in place"""
+    content_z = doc.pop('content_z', None)
+    if content_z is not None:
+        doc['content'] = zlib.decompress(content_z).decode()
+    return doc
+
+def apply_text_edits(text: str, edits: List[TextEdit]) -> str:
+    """Apply non-overlapping edits whose offsets refer to the unedited text"""
+    parts = []
+    cursor = 0
+    for edit in sorted(edits, key=lambda e: e.pos):
+        if edit.pos < cursor or edit.pos + edit.delete > len(text):
+            raise ValueError("Edits overlap or fall outside the base text")
+        parts.append(text[cursor:edit.pos])
+        parts.append(edit.insert)
+        cursor = edit.pos + edit.delete
+    parts.append(text[cursor:])
+    return "".join(parts)
+
+async def backfill_body_storage():
+    """Add previews to (and compress) clips and notes stored before previews existed,
+    and give clips stored before they had updated_at their created_at"""
+    for collection, id_field in (("clips", "clip_id"), ("notes", "note_id")):
+        async for doc in get_db()[collection].find(
+            {"preview": {"$exists": False}, "content": {"$type": "string"}},
+            {"_id": 0, id_field: 1, "content": 1}
+        ):
+            fields, unset = pack_body(doc['content'])
+            await get_db()[collection].update_one({id_field: doc[id_field]}, {"$set": fields, "$unset": unset})
+    async for doc in get_db().clips.find({"updated_at": {"$exists": False}}, {"_id": 0, "clip_id": 1, "created_at": 1}):
+        await get_db().clips.update_one(
+            {"clip_id": doc['clip_id'], "updated_at": {"$exists": False}},
+            {"$set": {"updated_at": doc.get('created_at') or datetime.now(timezone.utc).isoformat()}}
+        )
+
 # ============ CLIP ENDPOINTS ============
 
-@api_router.get("/clips", response_model=List[Clip])
-async def get_clips(request: Request, session_token: Optional[str] = Cookie(None), workspace_id: Optional[str] = None):
-    user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
+def parse_clip_dates(c: dict) -> dict:
+    if isinstance(c.get('created_at'), str):
+        c['created_at'] = datetime.fromisoformat(c['created_at'])
+    # Clips stored before updated_at existed (until backfill_body_storage reaches them)
+    c.setdefault('updated_at', c.get('created_at'))
+    if isinstance(c.get('updated_at'), str):
+        c['updated_at'] = datetime.fromisoformat(c['updated_at'])
+    return c
+
+async def load_clips(user_id: str, workspace_id: Optional[str] = None, previews: bool = False) -> list:
     query = {"user_id": user_id}
     if workspace_id:
         query["workspace_id"] = workspace_id
-    clips = await db.clips.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    projection = {"_id": 0, "content": 0, "content_z": 0} if previews else {"_id": 0}
+    clips = await get_db().clips.find(query, projection).sort("created_at", -1).to_list(1000)
     for c in clips:
-        if isinstance(c.get('created_at'), str):
-            c['created_at'] = datetime.fromisoformat(c['created_at'])
+        parse_clip_dates(unpack_body(c))
     return clips
 
+@api_router.get("/clips", response_model=List[Clip])
+async def get_clips(request: Request, session_token: Optional[str] = Cookie(None), workspace_id: Optional[str] = None):
+    """Clips with full bodies: ClipsList renders them and SearchView filters on them client-side.
+    Views that only list clips should use /clips/previews, which skips reading and inflating bodies."""
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    return await load_clips(user_id, workspace_id)
+
+@api_router.get("/clips/previews", response_model=List[ClipPreview])
+async def get_clip_previews(request: Request, session_token: Optional[str] = Cookie(None), workspace_id: Optional[str] = None):
+    """Clip list without bodies"""
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    return await load_clips(user_id, workspace_id, previews=True)
+
+@api_router.get("/clips/{clip_id}", response_model=Clip)
+async def get_clip(clip_id: str, request: Request, session_token: Optional[str] = Cookie(None)):
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    clip = await get_db().clips.find_one({"clip_id": clip_id, "user_id": user_id}, {"_id": 0})
+    if not clip:
+        raise HTTPException(status_code=404, detail="Clip not found")
+    return Clip(**parse_clip_dates(unpack_body(clip)))
+
 @api_router.post("/clips", response_model=Clip)
 async def create_clip(clip: dict, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
+    user_id = user.user_id if user else await get_guest_user_id(request)
     c = Clip(user_id=user_id, **clip)
-    doc = c.model_dump()
+    fields, unset = pack_body(c.content)
+    c.preview = fields['preview']
+    doc = c.model_dump(exclude=set(unset))
+    doc.update(fields)
+    session = await load_active_focus_session(user_id)
+    if session:
+        doc['session_id'] = session['session_id']
     doc['created_at'] = doc['created_at'].isoformat()
-    await db.clips.insert_one(doc)
+    doc['updated_at'] = doc['updated_at'].isoformat()
+    await get_db().clips.insert_one(doc)
+    change_hub.publish("clips", "upsert", user_id, c.clip_id, c.model_dump(mode='json'))
+    record_activity(user_id, c.created_at, {"clips": 1, "session_clips": 1} if session else {"clips": 1})
     return c
 
 @api_router.delete("/clips/{clip_id}")
 async def delete_clip(clip_id: str, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    result = await db.clips.delete_one({"clip_id": clip_id, "user_id": user_id})
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    result = await get_db().clips.delete_one({"clip_id": clip_id, "user_id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Clip not found")
+    await record_tombstone("clips", user_id, clip_id)
+    change_hub.publish("clips", "delete", user_id, clip_id)
     return {"message": "Deleted"}
 
 # ============ NOTE ENDPOINTS ============
 
+def parse_note_dates(n: dict) -> dict:
+    if isinstance(n.get('created_at'), str):
+        n['created_at'] = datetime.fromisoformat(n['created_at'])
+    if isinstance(n.get('updated_at'), str):
+        n['updated_at'] = datetime.fromisoformat(n['updated_at'])
+    return n
+
+async def load_notes(user_id: str, previews: bool = False) -> list:
+    projection = {"_id": 0, "content": 0, "content_z": 0} if previews else {"_id": 0}
+    notes = await get_db().notes.find({"user_id": user_id}, projection).sort("updated_at", -1).to_list(1000)
+    for n in notes:
+        parse_note_dates(unpack_body(n))
+    return notes
+
 @api_router.get("/notes", response_model=List[Note])
 async def get_notes(request: Request, session_token: Optional[str] = Cookie(None)):
+    """Notes with full bodies: NotesList edits them inline and SearchView filters on them client-side.
+    Views that only list notes should use /notes/previews, which skips reading and inflating bodies."""
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    notes = await db.notes.find({"user_id": user_id}, {"_id": 0}).sort("updated_at", -1).to_list(1000)
-    for n in notes:
-        if isinstance(n.get('created_at'), str):
-            n['created_at'] = datetime.fromisoformat(n['created_at'])
-        if isinstance(n.get('updated_at'), str):
-            n['updated_at'] = datetime.fromisoformat(n['updated_at'])
-    return notes
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    return await load_notes(user_id)
+
+@api_router.get("/notes/previews", response_model=List[NotePreview])
+async def get_note_previews(request: Request, session_token: Optional[str] = Cookie(None)):
+    """Note list without bodies; open a note with GET /notes/{note_id}"""
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    return await load_notes(user_id, previews=True)
+
+@api_router.get("/notes/{note_id}", response_model=Note)
+async def get_note(note_id: str, request: Request, session_token: Optional[str] = Cookie(None)):
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    note = await get_db().notes.find_one({"note_id": note_id, "user_id": user_id}, {"_id": 0})
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
+    return Note(**parse_note_dates(unpack_body(note)))
 
 @api_router.post("/notes", response_model=Note)
 async def create_note(note: dict, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
+    user_id = user.user_id if user else await get_guest_user_id(request)
     n = Note(user_id=user_id, **note)
-    doc = n.model_dump()
+    fields, unset = pack_body(n.content)
+    n.preview = fields['preview']
+    doc = n.model_dump(exclude=set(unset))
+    doc.update(fields)
     doc['created_at'] = doc['created_at'].isoformat()
     doc['updated_at'] = doc['updated_at'].isoformat()
-    await db.notes.insert_one(doc)
+    await get_db().notes.insert_one(doc)
+    change_hub.publish("notes", "upsert", user_id, n.note_id, n.model_dump(mode='json'))
+    record_activity(user_id, n.created_at, {"notes": 1})
     return n
 
 @api_router.put("/notes/{note_id}", response_model=Note)
 async def update_note(note_id: str, note: dict, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    note['updated_at'] = datetime.now(timezone.utc).isoformat()
-    result = await db.notes.update_one(
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    updates = {k: v for k, v in note.items() if k not in ('_id', 'note_id', 'user_id', 'version', 'preview', 'content_z', 'created_at')}
+    unset = {}
+    if isinstance(updates.get('content'), str):
+        fields, unset = pack_body(updates.pop('content'))
+        updates.update(fields)
+    updates['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update = {"$set": updates, "$inc": {"version": 1}}
+    if unset:
+        update["$unset"] = unset
+    updated = await get_db().notes.find_one_and_update(
         {"note_id": note_id, "user_id": user_id},
-        {"$set": note}
+        update,
+        projection={"_id": 0},
+        return_document=True  # ReturnDocument.AFTER
     )
-    if result.matched_count == 0:
+    if not updated:
         raise HTTPException(status_code=404, detail="Note not found")
-    updated = await db.notes.find_one({"note_id": note_id}, {"_id": 0})
-    if isinstance(updated.get('created_at'), str):
-        updated['created_at'] = datetime.fromisoformat(updated['created_at'])
-    if isinstance(updated.get('updated_at'), str):
-        updated['updated_at'] = datetime.fromisoformat(updated['updated_at'])
-    return Note(**updated)
+    updated_note = Note(**parse_note_dates(unpack_body(updated)))
+    change_hub.publish("notes", "upsert", user_id, note_id, updated_note.model_dump(mode='json'))
+    return updated_note
+
+@api_router.patch("/notes/{note_id}")
+async def patch_note(note_id: str, patch: NotePatch, request: Request, session_token: Optional[str] = Cookie(None)):
+    """Apply text edits made against `base_version`; 409 if the note has moved on"""
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    current = await get_db().notes.find_one({"note_id": note_id, "user_id": user_id}, {"_id": 0})
+    if not current:
+        raise HTTPException(status_code=404, detail="Note not found")
+    stored_version = current.get('version')
+    if (stored_version or 0) != patch.base_version:
+        raise HTTPException(status_code=409, detail={"error": "Version conflict", "version": stored_version or 0})
+    unpack_body(current)
+    try:
+        content = apply_text_edits(current['content'], patch.edits)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    fields, unset = pack_body(content)
+    fields['updated_at'] = datetime.now(timezone.utc).isoformat()
+    if patch.title is not None:
+        fields['title'] = patch.title
+    # Matching on the version read above makes the read-modify-write atomic, and
+    # means the stored version is now exactly one past it
+    result = await get_db().notes.update_one(
+        {"note_id": note_id, "user_id": user_id, "version": stored_version},
+        {"$set": fields, "$unset": unset, "$inc": {"version": 1}}
+    )
+    if result.matched_count == 0:
+        latest = await get_db().notes.find_one({"note_id": note_id, "user_id": user_id}, {"_id": 0, "version": 1})
+        raise HTTPException(status_code=409, detail={"error": "Version conflict", "version": (latest or {}).get('version', 0)})
+    
+    version = (stored_version or 0) + 1
+    current.update(fields, content=content, version=version)
+    change_hub.publish("notes", "upsert", user_id, note_id, Note(**parse_note_dates(current)).model_dump(mode='json'))
+    return {"note_id": note_id, "version": version, "updated_at": fields['updated_at']}
 
 @api_router.delete("/notes/{note_id}")
 async def delete_note(note_id: str, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    result = await db.notes.delete_one({"note_id": note_id, "user_id": user_id})
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    result = await get_db().notes.delete_one({"note_id": note_id, "user_id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Note not found")
+    await record_tombstone("notes", user_id, note_id)
+    change_hub.publish("notes", "delete", user_id, note_id)
     return {"message": "Deleted"}
 
 # ============ TASK ENDPOINTS ============
 
-@api_router.get("/tasks", response_model=List[Task])
-async def get_tasks(request: Request, session_token: Optional[str] = Cookie(None)):
-    user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    tasks = await db.tasks.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+async def load_tasks(user_id: str) -> list:
+    tasks = await get_db().tasks.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(1000)
     for t in tasks:
         if isinstance(t.get('created_at'), str):
             t['created_at'] = datetime.fromisoformat(t['created_at'])
+        if isinstance(t.get('updated_at'), str):
+            t['updated_at'] = datetime.fromisoformat(t['updated_at'])
         if t.get('due_date') and isinstance(t['due_date'], str):
             t['due_date'] = datetime.fromisoformat(t['due_date'])
     return tasks
 
+@api_router.get("/tasks", response_model=List[Task])
+async def get_tasks(request: Request, session_token: Optional[str] = Cookie(None)):
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    return await load_tasks(user_id)
+
 @api_router.post("/tasks", response_model=Task)
 async def create_task(task: dict, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
+    user_id = user.user_id if user else await get_guest_user_id(request)
     t = Task(user_id=user_id, **task)
     doc = t.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
+    doc['updated_at'] = doc['updated_at'].isoformat()
     if doc.get('due_date'):
         doc['due_date'] = doc['due_date'].isoformat()
-    await db.tasks.insert_one(doc)
+    await get_db().tasks.insert_one(doc)
+    change_hub.publish("tasks", "upsert", user_id, t.task_id, t.model_dump(mode='json'))
     return t
 
 @api_router.put("/tasks/{task_id}", response_model=Task)
 async def update_task(task_id: str, task: dict, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    result = await db.tasks.update_one(
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    task['updated_at'] = datetime.now(timezone.utc).isoformat()
+    result = await get_db().tasks.update_one(
         {"task_id": task_id, "user_id": user_id},
         {"$set": task}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Task not found")
-    updated = await db.tasks.find_one({"task_id": task_id}, {"_id": 0})
+    updated = await get_db().tasks.find_one({"task_id": task_id}, {"_id": 0})
     if isinstance(updated.get('created_at'), str):
         updated['created_at'] = datetime.fromisoformat(updated['created_at'])
+    if isinstance(updated.get('updated_at'), str):
+        updated['updated_at'] = datetime.fromisoformat(updated['updated_at'])
     if updated.get('due_date') and isinstance(updated['due_date'], str):
         updated['due_date'] = datetime.fromisoformat(updated['due_date'])
-    return Task(**updated)
+    updated_task = Task(**updated)
+    change_hub.publish("tasks", "upsert", user_id, task_id, updated_task.model_dump(mode='json'))
+    return updated_task
 
 @api_router.delete("/tasks/{task_id}")
 async def delete_task(task_id: str, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    result = await db.tasks.delete_one({"task_id": task_id, "user_id": user_id})
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    result = await get_db().tasks.delete_one({"task_id": task_id, "user_id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Task not found")
+    await record_tombstone("tasks", user_id, task_id)
+    change_hub.publish("tasks", "delete", user_id, task_id)
     return {"message": "Deleted"}
 
 # ============ BOOKMARK ENDPOINTS ============
 
-@api_router.get("/bookmarks", response_model=List[Bookmark])
-async def get_bookmarks(request: Request, session_token: Optional[str] = Cookie(None)):
-    user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    bookmarks = await db.bookmarks.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+async def load_bookmarks(user_id: str) -> list:
+    bookmarks = await get_db().bookmarks.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(1000)
     for b in bookmarks:
         if isinstance(b.get('created_at'), str):
             b['created_at'] = datetime.fromisoformat(b['created_at'])
+        if isinstance(b.get('updated_at'), str):
+            b['updated_at'] = datetime.fromisoformat(b['updated_at'])
     return bookmarks
 
+@api_router.get("/bookmarks", response_model=List[Bookmark])
+async def get_bookmarks(request: Request, session_token: Optional[str] = Cookie(None)):
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    return await load_bookmarks(user_id)
+
 @api_router.post("/bookmarks", response_model=Bookmark)
 async def create_bookmark(bookmark: dict, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
+    user_id = user.user_id if user else await get_guest_user_id(request)
     b = Bookmark(user_id=user_id, **bookmark)
     doc = b.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
-    await db.bookmarks.insert_one(doc)
+    doc['updated_at'] = doc['updated_at'].isoformat()
+    await get_db().bookmarks.insert_one(doc)
+    change_hub.publish("bookmarks", "upsert", user_id, b.bookmark_id, b.model_dump(mode='json'))
+    # Keep an offline reader snapshot of every bookmarked page, fetching (and paying for the
+    # LLM extraction) only when no fresh one exists, e.g. from another user's bookmark
+    page_url = normalize_page_url(b.url)
+    try:
+        snapshot = await load_reader_snapshot(page_url)
+        if snapshot is None or datetime.now(timezone.utc) - snapshot[1] > SNAPSHOT_REFRESH_AFTER:
+            schedule_snapshot_refresh(page_url)
+    except Exception as e:
+        logging.warning(f"Snapshot check failed for {page_url}: {e}")
     return b
 
 @api_router.delete("/bookmarks/{bookmark_id}")
 async def delete_bookmark(bookmark_id: str, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    result = await db.bookmarks.delete_one({"bookmark_id": bookmark_id, "user_id": user_id})
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    result = await get_db().bookmarks.delete_one({"bookmark_id": bookmark_id, "user_id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Bookmark not found")
+    await record_tombstone("bookmarks", user_id, bookmark_id)
+    change_hub.publish("bookmarks", "delete", user_id, bookmark_id)
     return {"message": "Deleted"}
 
 # ============ HISTORY ENDPOINTS ============
 
-@api_router.get("/history", response_model=List[BrowsingHistory])
-async def get_history(request: Request, session_token: Optional[str] = Cookie(None)):
-    user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    history = await db.browsing_history.find({"user_id": user_id}, {"_id": 0}).sort("visited_at", -1).limit(100).to_list(100)
+async def load_history(user_id: str) -> list:
+    history = await get_db().browsing_history.find({"user_id": user_id}, {"_id": 0}).sort("visited_at", -1).limit(100).to_list(100)
     for h in history:
         if isinstance(h.get('visited_at'), str):
             h['visited_at'] = datetime.fromisoformat(h['visited_at'])
+        if isinstance(h.get('updated_at'), str):
+            h['updated_at'] = datetime.fromisoformat(h['updated_at'])
     return history
 
+@api_router.get("/history", response_model=List[BrowsingHistory])
+async def get_history(request: Request, session_token: Optional[str] = Cookie(None)):
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    return await load_history(user_id)
+
 @api_router.post("/history", response_model=BrowsingHistory)
 async def add_history(history: dict, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
+    user_id = user.user_id if user else await get_guest_user_id(request)
     h = BrowsingHistory(user_id=user_id, **history)
     doc = h.model_dump()
+    # Classify the visit against the active focus session once, so rollups can be rebuilt later
+    session = await load_active_focus_session(user_id)
+    if session:
+        doc['session_id'] = session['session_id']
+        doc['on_topic'] = is_on_topic(session, h.title, h.url)
     doc['visited_at'] = doc['visited_at'].isoformat()
-    await db.browsing_history.insert_one(doc)
+    doc['updated_at'] = doc['updated_at'].isoformat()
+    await get_db().browsing_history.insert_one(doc)
+    task = asyncio.create_task(record_visit(doc))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
     return h
 
 @api_router.delete("/history")
 async def clear_history(request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    await db.browsing_history.delete_many({"user_id": user_id})
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    await get_db().browsing_history.delete_many({"user_id": user_id})
+    await record_tombstone("browsing_history", user_id, CLEARED_ALL)
+    schedule_rollup_rebuild(user_id)
     return {"message": "History cleared"}
 
 # ============ SETTINGS ENDPOINTS ============
 
-@api_router.get("/settings", response_model=UserSettings)
-async def get_settings(request: Request, session_token: Optional[str] = Cookie(None)):
-    user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    settings = await db.user_settings.find_one({"user_id": user_id}, {"_id": 0})
-    if not settings:
-        settings = UserSettings(user_id=user_id).model_dump()
-        settings['updated_at'] = settings['updated_at'].isoformat()
-        await db.user_settings.insert_one(settings)
+# user_id -> (expires_at, settings, etag)
+_settings_cache = OrderedDict()
+
+def default_settings_doc(user_id: str) -> dict:
+    doc = UserSettings(user_id=user_id).model_dump(exclude={"user_id", "version"})
+    doc['updated_at'] = doc['updated_at'].isoformat()
+    return doc
+
+def cache_settings(settings: UserSettings):
+    """Cache settings unless a newer version is already cached; returns (settings, etag)"""
+    cached = _settings_cache.get(settings.user_id)
+    if cached and cached[1].version > settings.version:
+        return cached[1], cached[2]
+    etag = '"' + hashlib.sha1(settings.model_dump_json().encode()).hexdigest()[:16] + '"'
+    _settings_cache[settings.user_id] = (time.monotonic() + SETTINGS_CACHE_TTL, settings, etag)
+    _settings_cache.move_to_end(settings.user_id)
+    while len(_settings_cache) > SETTINGS_CACHE_ENTRIES:
+        _settings_cache.popitem(last=False)
+    return settings, etag
+
+def invalidate_settings(user_id: str):
+    _settings_cache.pop(user_id, None)
+
+async def load_settings_entry(user_id: str):
+    """Settings and their ETag, from the cache or a single atomic upsert"""
+    cached = _settings_cache.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1], cached[2]
+    settings = await get_db().user_settings.find_one_and_update(
+        {"user_id": user_id},
+        {"$setOnInsert": default_settings_doc(user_id)},
+        upsert=True,
+        projection={"_id": 0},
+        return_document=True  # ReturnDocument.AFTER
+    )
     if isinstance(settings.get('updated_at'), str):
         settings['updated_at'] = datetime.fromisoformat(settings['updated_at'])
-    return UserSettings(**settings)
+    return cache_settings(UserSettings(**settings))
+
+async def load_settings(user_id: str) -> UserSettings:
+    settings, _ = await load_settings_entry(user_id)
+    return settings
+
+@api_router.get("/settings", response_model=UserSettings)
+async def get_settings(request: Request, response: Response, session_token: Optional[str] = Cookie(None)):
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    settings, etag = await load_settings_entry(user_id)
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return settings
 
 @api_router.put("/settings", response_model=UserSettings)
-async def update_settings(settings: dict, request: Request, session_token: Optional[str] = Cookie(None)):
+async def update_settings(settings: dict, request: Request, response: Response, session_token: Optional[str] = Cookie(None)):
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    settings['updated_at'] = datetime.now(timezone.utc).isoformat()
-    await db.user_settings.update_one(
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    updates = {k: v for k, v in settings.items() if k not in ('_id', 'user_id', 'version', 'updated_at')}
+    updates['updated_at'] = datetime.now(timezone.utc).isoformat()
+    defaults = {k: v for k, v in default_settings_doc(user_id).items() if k not in updates}
+    updated = await get_db().user_settings.find_one_and_update(
         {"user_id": user_id},
-        {"$set": settings},
-        upsert=True
+        {"$set": updates, "$setOnInsert": defaults, "$inc": {"version": 1}},
+        upsert=True,
+        projection={"_id": 0},
+        return_document=True  # ReturnDocument.AFTER
     )
-    updated = await db.user_settings.find_one({"user_id": user_id}, {"_id": 0})
     if isinstance(updated.get('updated_at'), str):
         updated['updated_at'] = datetime.fromisoformat(updated['updated_at'])
-    return UserSettings(**updated)
+    updated_settings, etag = cache_settings(UserSettings(**updated))
+    response.headers["ETag"] = etag
+    return updated_settings
 
 # ============ FOCUS SESSION ENDPOINTS ============
 
-@api_router.get("/focus_sessions", response_model=List[FocusSession])
-async def get_focus_sessions(request: Request, session_token: Optional[str] = Cookie(None)):
-    user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    sessions = await db.focus_sessions.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(100)
+async def load_focus_sessions(user_id: str) -> list:
+    sessions = await get_db().focus_sessions.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(100)
     for s in sessions:
         if isinstance(s.get('created_at'), str):
             s['created_at'] = datetime.fromisoformat(s['created_at'])
+        if isinstance(s.get('updated_at'), str):
+            s['updated_at'] = datetime.fromisoformat(s['updated_at'])
     return sessions
 
+@api_router.get("/focus_sessions", response_model=List[FocusSession])
+async def get_focus_sessions(request: Request, session_token: Optional[str] = Cookie(None)):
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    return await load_focus_sessions(user_id)
+
 @api_router.put("/focus_sessions/{session_id}")
 async def update_focus_session(session_id: str, updates: dict, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
-    result = await db.focus_sessions.update_one(
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    updates['updated_at'] = datetime.now(timezone.utc).isoformat()
+    updated = await get_db().focus_sessions.find_one_and_update(
         {"session_id": session_id, "user_id": user_id},
-        {"$set": updates}
+        {"$set": updates},
+        projection={"_id": 0},
+        return_document=True  # ReturnDocument.AFTER
     )
-    if result.matched_count == 0:
+    if updated is None:
         raise HTTPException(status_code=404, detail="Session not found")
+    change_hub.publish("focus_sessions", "upsert", user_id, session_id, updated)
     return {"message": "Updated"}
 
+# ============ ACTIVITY ANALYTICS ============
+
+# Strong references to in-flight rollup rebuilds, keyed by user_id
+_rollup_rebuilds = {}
+
+def topic_match(session: dict, text: str, title: str = ""):
+    """Score text against a focus session's topic; returns (weighted score, keyword overlap).
+
+    Server-side counterpart of the weighting in useDriftDetection.js.
+    """
+    topic = session.get('topic') or {}
+    rules = session.get('local_matching_rules') or {}
+    keywords = [k for k in topic.get('keywords', []) if isinstance(k, dict) and k.get('kw')]
+    phrases = [p for p in topic.get('phrases', []) if isinstance(p, str) and p]
+    text = text.lower()
+    tokens = set(_PUNCTUATION_RE.sub(' ', text).split())
+    
+    total_weight = 0.0
+    matched_weight = 0.0
+    matched_keywords = 0
+    for kw in keywords:
+        weight = kw.get('weight') or 0.5
+        total_weight += weight
+        word = kw['kw'].lower()
+        if word in tokens or word in text:
+            matched_weight += weight
+            matched_keywords += 1
+    for phrase in phrases:
+        total_weight += 0.3
+        if phrase.lower() in text:
+            matched_weight += 0.3
+    
+    score = matched_weight / total_weight if total_weight else 0.0
+    title = title.lower()
+    if any(kw['kw'].lower() in title for kw in keywords):
+        score *= rules.get('titleBoost') or 1.3
+    overlap = matched_keywords / len(keywords) if keywords else 0.0
+    return min(score, 1.0), overlap
+
+def is_on_topic(session: dict, title: str, url: str) -> bool:
+    """Visits only carry a title and URL, so keyword overlap alone also counts as on topic"""
+    rules = session.get('local_matching_rules') or {}
+    score, overlap = topic_match(session, f"{title} {url}", title)
+    return score >= (rules.get('minWeightedScore') or 0.6) or overlap >= (rules.get('minKeywordOverlap') or 0.2)
+
+async def load_active_focus_session(user_id: str) -> Optional[dict]:
+    return await get_db().focus_sessions.find_one(
+        {"user_id": user_id, "status": "active"},
+        {"_id": 0, "session_id": 1, "topic": 1, "local_matching_rules": 1},
+        sort=[("created_at", -1)]
+    )
+
+def domain_key(url: str) -> str:
+    """Host of a URL, escaped for use as a MongoDB field name"""
+    host = (urlsplit(url).hostname or "unknown").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return host.replace(".", "\uff0e").replace("$", "\uff04")
+
+def parse_activity_time(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def visit_counters(visit: dict, visited_at: datetime) -> dict:
+    counters = {
+        "visits": 1,
+        f"hours.{visited_at.hour}": 1,
+        f"domains.{domain_key(visit.get('url', ''))}": 1
+    }
+    if visit.get('session_id'):
+        counters["session_visits"] = 1
+        counters["on_topic_visits" if visit.get('on_topic') else "drift_events"] = 1
+    return counters
+
+def dwell_counters(previous: dict, seconds: float) -> dict:
+    """Time credited to the previous visit, up to the next one"""
+    seconds = round(min(seconds, ACTIVITY_IDLE_CAP))
+    counters = {"browse_seconds": seconds}
+    if previous.get('session_id'):
+        counters["focus_seconds" if previous.get('on_topic') else "drift_seconds"] = seconds
+    return counters
+
+async def increment_rollup(user_id: str, when: datetime, counters: dict):
+    await get_db().activity_daily.update_one(
+        {"user_id": user_id, "day": when.strftime("%Y-%m-%d")},
+        {"$inc": counters},
+        upsert=True
+    )
+
+async def record_visit(visit: dict):
+    """Fold one stored history row into the rollups"""
+    try:
+        user_id = visit['user_id']
+        visited_at = parse_activity_time(visit['visited_at'])
+        previous = await get_db().activity_state.find_one_and_update(
+            {"user_id": user_id},
+            {"$set": {
+                "visited_at": visited_at.isoformat(),
+                "session_id": visit.get('session_id'),
+                "on_topic": visit.get('on_topic', False)
+            }},
+            upsert=True,
+            projection={"_id": 0}
+        )
+        await increment_rollup(user_id, visited_at, visit_counters(visit, visited_at))
+        if previous:
+            previous_at = parse_activity_time(previous['visited_at'])
+            gap = (visited_at - previous_at).total_seconds()
+            if gap > 0:
+                await increment_rollup(user_id, previous_at, dwell_counters(previous, gap))
+    except Exception as e:
+        logging.warning(f"Activity rollup update failed: {e}")
+
+def record_activity(user_id: str, when: datetime, counters: dict):
+    """Bump daily counters in the background"""
+    async def update():
+        try:
+            await increment_rollup(user_id, when, counters)
+        except Exception as e:
+            logging.warning(f"Activity rollup update failed: {e}")
+    task = asyncio.create_task(update())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def rebuild_activity_rollups(user_id: str):
+    """Recompute a user's rollups from raw data (after imports, merges and history clears).
+
+    Streams history in visit order; memory grows with the number of days, not visits.
+    """
+    days = {}
+    
+    def bump(when: datetime, counters: dict):
+        day = days.setdefault(when.strftime("%Y-%m-%d"), {})
+        for field, amount in counters.items():
+            day[field] = day.get(field, 0) + amount
+    
+    db = get_db()
+    previous = None
+    async for visit in db.browsing_history.find(
+        {"user_id": user_id}, {"_id": 0, "url": 1, "visited_at": 1, "session_id": 1, "on_topic": 1}
+    ).sort("visited_at", 1).batch_size(EXPORT_BATCH_SIZE):
+        visited_at = parse_activity_time(visit['visited_at'])
+        bump(visited_at, visit_counters(visit, visited_at))
+        if previous:
+            previous_at = parse_activity_time(previous['visited_at'])
+            gap = (visited_at - previous_at).total_seconds()
+            if gap > 0:
+                bump(previous_at, dwell_counters(previous, gap))
+        previous = visit
+    
+    for collection, field in (("clips", "clips"), ("notes", "notes"), ("focus_sessions", "sessions")):
+        async for doc in db[collection].find(
+            {"user_id": user_id}, {"_id": 0, "created_at": 1, "session_id": 1}
+        ).batch_size(EXPORT_BATCH_SIZE):
+            if not doc.get('created_at'):
+                continue
+            counters = {field: 1}
+            if collection == "clips" and doc.get('session_id'):
+                counters["session_clips"] = 1
+            bump(parse_activity_time(doc['created_at']), counters)
+    
+    # Counters are stored as nested maps, like the $inc paths used on write
+    rollups = []
+    for day, counters in days.items():
+        doc = {"user_id": user_id, "day": day}
+        for field, amount in counters.items():
+            group, _, key = field.partition(".")
+            if key:
+                doc.setdefault(group, {})[key] = amount
+            else:
+                doc[field] = amount
+        rollups.append(doc)
+    
+    await db.activity_daily.delete_many({"user_id": user_id})
+    if rollups:
+        await db.activity_daily.insert_many(rollups)
+    if previous:
+        await db.activity_state.update_one(
+            {"user_id": user_id},
+            {"$set": {
+                "visited_at": parse_activity_time(previous['visited_at']).isoformat(),
+                "session_id": previous.get('session_id'),
+                "on_topic": previous.get('on_topic', False)
+            }},
+            upsert=True
+        )
+    else:
+        await db.activity_state.delete_one({"user_id": user_id})
+
+def schedule_rollup_rebuild(user_id: str):
+    """Rebuild a user's rollups in the background, at most once concurrently per user"""
+    if user_id in _rollup_rebuilds:
+        return
+    
+    async def rebuild():
+        try:
+            await rebuild_activity_rollups(user_id)
+        except Exception as e:
+            logging.warning(f"Activity rollup rebuild failed for {user_id}: {e}")
+        finally:
+            _rollup_rebuilds.pop(user_id, None)
+    
+    _rollup_rebuilds[user_id] = asyncio.create_task(rebuild())
+
+@api_router.get("/activity/summary")
+async def activity_summary(request: Request, session_token: Optional[str] = Cookie(None), days: int = 7):
+    """Browsing and focus statistics for the last `days` UTC days, read from the daily rollups"""
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    days = max(1, min(days, ACTIVITY_SUMMARY_MAX_DAYS))
+    today = datetime.now(timezone.utc).date()
+    day_keys = [(today - timedelta(days=offset)).isoformat() for offset in range(days - 1, -1, -1)]
+    rollups = await get_db().activity_daily.find(
+        {"user_id": user_id, "day": {"$gte": day_keys[0]}}, {"_id": 0}
+    ).to_list(ACTIVITY_SUMMARY_MAX_DAYS)
+    by_day = {r['day']: r for r in rollups}
+    
+    totals = {}
+    hours = [0] * 24
+    domains = {}
+    daily = []
+    for day in day_keys:
+        rollup = by_day.get(day, {})
+        for field in ("visits", "clips", "notes", "sessions", "session_clips", "session_visits",
+                      "on_topic_visits", "drift_events", "browse_seconds", "focus_seconds", "drift_seconds"):
+            totals[field] = totals.get(field, 0) + rollup.get(field, 0)
+        for hour, count in (rollup.get('hours') or {}).items():
+            hours[int(hour)] += count
+        for domain, count in (rollup.get('domains') or {}).items():
+            domains[domain] = domains.get(domain, 0) + count
+        daily.append({
+            "day": day,
+            "visits": rollup.get('visits', 0),
+            "focusMinutes": round(rollup.get('focus_seconds', 0) / 60),
+            "clips": rollup.get('clips', 0),
+            "notes": rollup.get('notes', 0),
+            "sessions": rollup.get('sessions', 0)
+        })
+    
+    top_domains = sorted(domains.items(), key=lambda item: item[1], reverse=True)[:ACTIVITY_TOP_DOMAINS]
+    return {
+        "days": days,
+        "totals": {
+            "visits": totals["visits"],
+            "clips": totals["clips"],
+            "notes": totals["notes"],
+            "sessions": totals["sessions"],
+            "browseMinutes": round(totals["browse_seconds"] / 60),
+            "focusMinutes": round(totals["focus_seconds"] / 60),
+            "driftMinutes": round(totals["drift_seconds"] / 60)
+        },
+        "driftRate": round(totals["drift_events"] / totals["session_visits"], 3) if totals["session_visits"] else None,
+        "clipsPerSession": round(totals["session_clips"] / totals["sessions"], 2) if totals["sessions"] else None,
+        "topDomains": [
+            {"domain": domain.replace("\uff0e", ".").replace("\uff04", "$"), "visits": count}
+            for domain, count in top_domains
+        ],
+        "hours": hours,
+        "daily": daily
+    }
+
+# ============ BOOTSTRAP & SYNC ENDPOINTS ============
+
+# Collections covered by /api/sync: response key -> (collection, id field, model)
+SYNC_COLLECTIONS = {
+    "workspaces": ("workspaces", "workspace_id", Workspace),
+    "clips": ("clips", "clip_id", Clip),
+    "notes": ("notes", "note_id", Note),
+    "tasks": ("tasks", "task_id", Task),
+    "bookmarks": ("bookmarks", "bookmark_id", Bookmark),
+    "history": ("browsing_history", "history_id", BrowsingHistory),
+    "focus_sessions": ("focus_sessions", "session_id", FocusSession),
+}
+
+def sync_cursor(moment: datetime) -> str:
+    """Cursor string for a moment; Z instead of +00:00 so an unencoded query string can't turn it into a space"""
+    return moment.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+def new_sync_cursor() -> str:
+    """Cursor for the next /api/sync call, backed off to cover writes still in flight"""
+    return sync_cursor(datetime.now(timezone.utc) - SYNC_CURSOR_SKEW)
+
+@api_router.get("/bootstrap")
+async def bootstrap(request: Request, session_token: Optional[str] = Cookie(None)):
+    """Everything the dashboard needs on load, in one response.
+
+    Clips and notes come as previews so a cold load never inflates every large
+    body; open one with GET /clips/{clip_id} or /notes/{note_id}.
+    """
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    cursor = new_sync_cursor()
+    workspaces, clips, notes, tasks, bookmarks, history, settings, focus_sessions = await asyncio.gather(
+        load_workspaces(user_id),
+        load_clips(user_id, previews=True),
+        load_notes(user_id, previews=True),
+        load_tasks(user_id),
+        load_bookmarks(user_id),
+        load_history(user_id),
+        load_settings(user_id),
+        load_focus_sessions(user_id)
+    )
+    return {
+        "user": user,
+        "workspaces": [Workspace(**w) for w in workspaces],
+        "clips": [ClipPreview(**c) for c in clips],
+        "notes": [NotePreview(**n) for n in notes],
+        "tasks": [Task(**t) for t in tasks],
+        "bookmarks": [Bookmark(**b) for b in bookmarks],
+        "history": [BrowsingHistory(**h) for h in history],
+        "settings": settings,
+        "focus_sessions": [FocusSession(**s) for s in focus_sessions],
+        "cursor": cursor
+    }
+
+@api_router.get("/sync")
+async def sync(since: str, request: Request, session_token: Optional[str] = Cookie(None)):
+    """Documents created, updated or deleted after the given cursor"""
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    try:
+        # Older cursors carried +00:00, which arrives as a space when the client didn't encode it
+        since_dt = datetime.fromisoformat(since.strip().replace(" ", "+"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid sync cursor")
+    if since_dt.tzinfo is None:
+        since_dt = since_dt.replace(tzinfo=timezone.utc)
+    
+    cursor = new_sync_cursor()
+    # Tombstones older than the retention window are gone; the client must bootstrap again
+    if since_dt < datetime.now(timezone.utc) - TOMBSTONE_RETENTION:
+        return {"full_resync": True, "cursor": cursor}
+    since = since_dt.astimezone(timezone.utc).isoformat()
+    
+    async def changed(collection: str) -> list:
+        return await get_db()[collection].find(
+            {"user_id": user_id, "updated_at": {"$gt": since}}, {"_id": 0}
+        ).sort("updated_at", 1).to_list(SYNC_PAGE_SIZE + 1)
+    
+    keys = list(SYNC_COLLECTIONS)
+    results = await asyncio.gather(
+        *[changed(SYNC_COLLECTIONS[key][0]) for key in keys],
+        get_db().user_settings.find_one({"user_id": user_id, "updated_at": {"$gt": since}}, {"_id": 0}),
+        get_db().tombstones.find({"user_id": user_id, "deleted_at": {"$gt": since}}, {"_id": 0}).to_list(None)
+    )
+    settings_doc, tombstones = results[-2], results[-1]
+    
+    # A collection with more than a page of changes is cut at its last complete updated_at and the
+    # cursor is pulled back to the earliest cut, so the next call resumes there instead of skipping
+    # what didn't fit. Anything already sent past that point is simply sent again.
+    pages = dict(zip(keys, results))
+    resume_at = None
+    for key, docs in pages.items():
+        if len(docs) <= SYNC_PAGE_SIZE:
+            continue
+        boundary = docs[SYNC_PAGE_SIZE - 1]["updated_at"]
+        docs = [doc for doc in docs[:SYNC_PAGE_SIZE] if doc["updated_at"] < boundary]
+        if not docs:
+            # A whole page shares one timestamp, so no cursor can split it
+            return {"full_resync": True, "cursor": cursor}
+        pages[key] = docs
+        last = datetime.fromisoformat(docs[-1]["updated_at"])
+        resume_at = last if resume_at is None else min(resume_at, last)
+    has_more = resume_at is not None
+    if has_more:
+        cursor = sync_cursor(resume_at)
+    
+    changes = {key: [SYNC_COLLECTIONS[key][2](**unpack_body(doc)) for doc in docs] for key, docs in pages.items()}
+    deleted = {key: [] for key in keys}
+    cleared = []
+    collection_keys = {collection: key for key, (collection, _, _) in SYNC_COLLECTIONS.items()}
+    for tombstone in tombstones:
+        key = collection_keys.get(tombstone["collection"])
+        if key is None:
+            continue
+        if tombstone["doc_id"] == CLEARED_ALL:
+            cleared.append(key)
+        else:
+            deleted[key].append(tombstone["doc_id"])
+    
+    return {
+        "changes": changes,
+        "settings": UserSettings(**settings_doc) if settings_doc else None,
+        "deleted": deleted,
+        "cleared": cleared,
+        "has_more": has_more,
+        "cursor": cursor
+    }
+
+# ============ REAL-TIME CHANGE FEED ============
+
+# Collections pushed over /api/ws: collection -> id field
+WS_COLLECTIONS = {
+    "clips": "clip_id",
+    "notes": "note_id",
+    "tasks": "task_id",
+    "bookmarks": "bookmark_id",
+    "focus_sessions": "session_id",
+}
+
+class ChangeHub:
+    """Fans per-user change events out to connected WebSockets.
+
+    With a replica set, events come from one shared Mongo change stream;
+    otherwise request handlers publish them in-process.
+    """
+    def __init__(self):
+        self.subscribers = {}  # user_id -> set of per-socket queues
+        self.change_stream_active = False
+        self._watch_task = None
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[user_id]
+
+    def dispatch(self, user_id: str, collection: str, op: str, doc_id: str, doc: Optional[dict] = None):
+        queues = self.subscribers.get(user_id)
+        if not queues:
+            return
+        # Serialize once per event, not once per socket
+        message = json.dumps(
+            {"type": "change", "collection": collection, "op": op, "id": doc_id, "doc": doc},
+            default=str
+        )
+        for queue in queues:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Slow consumer: drop its backlog and ask it to catch up via /api/sync
+                self._ask_resync(queue)
+
+    def _ask_resync(self, queue: asyncio.Queue):
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(json.dumps({"type": "resync"}))
+
+    def request_resync(self, user_id: str):
+        """Tell a user's sockets to catch up via /api/sync, e.g. after a bulk import"""
+        for queue in self.subscribers.get(user_id, ()):
+            self._ask_resync(queue)
+
+    def publish(self, collection: str, op: str, user_id: str, doc_id: str, doc: Optional[dict] = None):
+        """Publish from a request handler; a no-op while the change stream delivers events"""
+        if not self.change_stream_active:
+            self.dispatch(user_id, collection, op, doc_id, doc)
+
+    async def start(self):
+        try:
+            hello = await get_mongo_client().admin.command('hello')
+        except Exception as e:
+            logging.warning(f"Change streams unavailable, using in-process pub/sub: {e}")
+            return
+        if 'setName' not in hello:
+            logging.info("MongoDB is not a replica set, using in-process pub/sub for /api/ws")
+            return
+        self.change_stream_active = True
+        self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watch_task:
+            self._watch_task.cancel()
+
+    async def _watch(self):
+        pipeline = [{"$match": {
+            "operationType": {"$in": ["insert", "update", "replace"]},
+            "ns.coll": {"$in": list(WS_COLLECTIONS) + ["tombstones", "user_settings"]}
+        }}]
+        resume_token = None
+        while True:
+            try:
+                async with get_db().watch(pipeline, full_document='updateLookup', resume_after=resume_token) as stream:
+                    self.change_stream_active = True
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self._handle_change(change)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Fall back to in-process publishing until the stream is re-established
+                self.change_stream_active = False
+                logging.error(f"Change stream error: {e}")
+                await asyncio.sleep(1)
+
+    def _handle_change(self, change: dict):
+        doc = change.get('fullDocument')
+        collection = change['ns']['coll']
+        if doc and collection == 'user_settings':
+            # Another worker may have written these; drop our cached copy
+            invalidate_settings(doc['user_id'])
+            return
+        if not doc or doc.get('user_id') not in self.subscribers:
+            return
+        if collection == 'tombstones':
+            # Deletes are observed through their tombstones, which carry the user_id
+            if doc['collection'] in WS_COLLECTIONS:
+                self.dispatch(doc['user_id'], doc['collection'], "delete", doc['doc_id'])
+            return
+        doc.pop('_id', None)
+        unpack_body(doc)
+        self.dispatch(doc['user_id'], collection, "upsert", doc[WS_COLLECTIONS[collection]], doc)
+
+change_hub = ChangeHub()
+
+async def _pump_changes(websocket: WebSocket, queue: asyncio.Queue):
+    while True:
+        await websocket.send_text(await queue.get())
+
+@api_router.websocket("/ws")
+async def ws_changes(websocket: WebSocket, session_token: Optional[str] = Cookie(None)):
+    """Push clip/note/task/bookmark/focus session changes for the current user.
+
+    Browsers authenticate with the session cookie and other clients with an
+    Authorization header; tokens aren't accepted in the URL, where access logs keep them.
+    """
+    user = await get_current_user(websocket, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(websocket)
+    
+    await websocket.accept()
+    queue = change_hub.subscribe(user_id)
+    sender = asyncio.create_task(_pump_changes(websocket, queue))
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+    finally:
+        sender.cancel()
+        change_hub.unsubscribe(user_id, queue)
+
+# ============ EXPORT & IMPORT ============
+
+async def export_lines(user_id: str):
+    """NDJSON lines for everything a user owns, read batch by batch from Motor cursors"""
+    yield json.dumps({
+        "type": "header",
+        "version": EXPORT_FORMAT_VERSION,
+        "user_id": user_id,
+        "exported_at": datetime.now(timezone.utc).isoformat()
+    }) + "\n"
+    for key, (collection, _, _) in SYNC_COLLECTIONS.items():
+        cursor = get_db()[collection].find({"user_id": user_id}, {"_id": 0}).batch_size(EXPORT_BATCH_SIZE)
+        async for doc in cursor:
+            yield json.dumps({"collection": key, "doc": unpack_body(doc)}, default=str) + "\n"
+    settings = await get_db().user_settings.find_one({"user_id": user_id}, {"_id": 0})
+    if settings:
+        yield json.dumps({"collection": "settings", "doc": settings}, default=str) + "\n"
+
+async def export_stream(user_id: str, compress: bool):
+    """Group export lines into socket-sized chunks, gzip-compressed when asked"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    size = 0
+    async for line in export_lines(user_id):
+        data = line.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= EXPORT_CHUNK_SIZE:
+            chunk = b"".join(buffer)
+            buffer, size = [], 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+    chunk = b"".join(buffer)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+@api_router.get("/export")
+async def export_data(request: Request, session_token: Optional[str] = Cookie(None),
+                      compress: bool = Query(False, alias="gzip")):
+    """Stream the user's whole data set as NDJSON; gzip=true compresses it regardless of Accept-Encoding"""
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    filename = f"deepbrowser-export-{datetime.now(timezone.utc):%Y%m%d}.ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(export_stream(user_id, compress), media_type="application/x-ndjson", headers=headers)
+
+def remap_import_id(doc_id: str, user_id: str) -> str:
+    """Stable new id for a document imported from another account.
+
+    Derived from the target user and the original id, so importing the same
+    file twice yields the same ids and the second run deduplicates.
+    """
+    prefix = doc_id.split('_', 1)[0] if '_' in doc_id else "imp"
+    return f"{prefix}_{hashlib.sha1(f'{user_id}:{doc_id}'.encode()).hexdigest()[:12]}"
+
+def prepare_import_doc(key: str, doc: dict, user_id: str, remap: bool, imported_at: str) -> dict:
+    """Validate an exported document and turn it into what the endpoints would have stored"""
+    _, id_field, model = SYNC_COLLECTIONS[key]
+    doc = dict(doc, user_id=user_id)
+    if remap:
+        if doc.get(id_field):
+            doc[id_field] = remap_import_id(doc[id_field], user_id)
+        if id_field != 'workspace_id' and doc.get('workspace_id'):
+            doc['workspace_id'] = remap_import_id(doc['workspace_id'], user_id)
+    # Fresh updated_at so connected clients pick the documents up through /api/sync
+    stored = model(**unpack_body(doc)).model_dump()
+    stored['updated_at'] = imported_at
+    for field in IMPORT_EXTRA_FIELDS.get(key, ()):
+        if doc.get(field) is not None:
+            stored[field] = doc[field]
+    if remap and stored.get('session_id') and id_field != 'session_id':
+        # Focus sessions are remapped too, so links to them must follow
+        stored['session_id'] = remap_import_id(stored['session_id'], user_id)
+    for field, value in stored.items():
+        if isinstance(value, datetime):
+            stored[field] = value.isoformat()
+    if key in ("clips", "notes"):
+        fields, unset = pack_body(stored['content'])
+        for field in unset:
+            stored.pop(field, None)
+        stored.update(fields)
+    return stored
+
+async def import_ndjson(user_id: str, chunks, compressed: bool) -> dict:
+    """Insert an export stream batch by batch; documents the user already has are skipped"""
+    from pymongo import UpdateOne
+    
+    inserted = {key: 0 for key in SYNC_COLLECTIONS}
+    duplicates = {key: 0 for key in SYNC_COLLECTIONS}
+    invalid = 0
+    batches = {key: [] for key in SYNC_COLLECTIONS}
+    remap = True  # exports without a header are treated as coming from another account
+    imported_at = datetime.now(timezone.utc).isoformat()
+    
+    async def flush(key: str):
+        batch, batches[key] = batches[key], []
+        if not batch:
+            return
+        collection, id_field, _ = SYNC_COLLECTIONS[key]
+        result = await get_db()[collection].bulk_write([
+            UpdateOne({id_field: doc[id_field], "user_id": user_id}, {"$setOnInsert": doc}, upsert=True)
+            for doc in batch
+        ], ordered=False)
+        inserted[key] += result.upserted_count
+        duplicates[key] += result.matched_count
+    
+    async def handle(line: bytes):
+        nonlocal invalid, remap
+        if not line.strip():
+            return
+        try:
+            record = json.loads(line)
+            if record.get("type") == "header":
+                remap = record.get("user_id") != user_id
+                return
+            key, doc = record["collection"], record["doc"]
+            if key == "settings":
+                updates = {k: v for k, v in doc.items() if k not in ('_id', 'user_id', 'version', 'updated_at')}
+                updates['updated_at'] = imported_at
+                await get_db().user_settings.update_one(
+                    {"user_id": user_id}, {"$set": updates, "$inc": {"version": 1}}, upsert=True
+                )
+                invalidate_settings(user_id)
+                return
+            batches[key].append(prepare_import_doc(key, doc, user_id, remap, imported_at))
+        except (ValueError, KeyError, TypeError, ValidationError):
+            invalid += 1
+            return
+        if len(batches[key]) >= IMPORT_BATCH_SIZE:
+            await flush(key)
+    
+    pending = bytearray()
+    
+    async def feed(data: bytes):
+        nonlocal pending
+        pending += data
+        if b"\n" in data:
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                await handle(line)
+        if len(pending) > IMPORT_MAX_LINE:
+            raise HTTPException(status_code=413, detail="Import line too long")
+    
+    decompressor = None
+    first = True
+    async for chunk in chunks:
+        if first:
+            first = False
+            # Accept gzip files as well as gzip Content-Encoding
+            if compressed or chunk[:2] == b"\x1f\x8b":
+                decompressor = zlib.decompressobj(47)
+        if not decompressor:
+            await feed(chunk)
+            continue
+        # Inflate in bounded steps; whatever didn't fit waits in unconsumed_tail
+        await feed(decompressor.decompress(chunk, IMPORT_INFLATE_CHUNK))
+        while decompressor.unconsumed_tail:
+            await feed(decompressor.decompress(decompressor.unconsumed_tail, IMPORT_INFLATE_CHUNK))
+    if decompressor:
+        await feed(decompressor.flush())
+    for line in pending.split(b"\n"):
+        await handle(line)
+    for key in SYNC_COLLECTIONS:
+        await flush(key)
+    
+    return {"inserted": inserted, "duplicates": duplicates, "invalid": invalid}
+
+@api_router.post("/import")
+async def import_data(request: Request, session_token: Optional[str] = Cookie(None)):
+    """Import an /api/export stream (NDJSON, optionally gzip) sent as the raw request body"""
+    user = await get_optional_user(request, session_token)
+    user_id = user.user_id if user else await get_guest_user_id(request)
+    compressed = request.headers.get("Content-Encoding", "").lower() == "gzip"
+    try:
+        result = await import_ndjson(user_id, request.stream(), compressed)
+    except zlib.error as e:
+        raise HTTPException(status_code=400, detail=f"Invalid gzip data: {e}")
+    change_hub.request_resync(user_id)
+    schedule_rollup_rebuild(user_id)
+    return result
+
+# ============ DOCUMENT EXTRACTION ============
+
+class TextExtractor:
+    """Incrementally decodes a text body line by line and stops at max_chars.
+
+    feed() takes raw body chunks; done turns true once the budget is spent, so
+    the caller can stop reading; finish() returns the text. Subclasses
+    override add_line() to strip format-specific syntax.
+    """
+    kind = "text"
+
+    def __init__(self, max_chars: int, charset: str = "utf-8"):
+        self.max_chars = max_chars
+        try:
+            self.decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+        except LookupError:
+            self.decoder = codecs.getincrementaldecoder("utf-8")(errors='replace')
+        self.parts = []
+        self.size = 0
+        self.pending = ""
+        self.title = None
+
+    @property
+    def done(self) -> bool:
+        return self.size >= self.max_chars
+
+    def feed(self, chunk: bytes):
+        *lines, self.pending = (self.pending + self.decoder.decode(chunk)).split("\n")
+        for line in lines:
+            if self.done:
+                return
+            self.add_line(line)
+        # A line longer than the remaining budget can't fit anyway, so emit it now
+        # rather than buffering a body that may never contain a newline
+        if len(self.pending) > self.max_chars - self.size:
+            line, self.pending = self.pending, ""
+            self.add_line(line)
+
+    def add_line(self, line: str):
+        self.emit(line.rstrip())
+
+    def emit(self, text: str):
+        if self.done:
+            return
+        text = text[:self.max_chars - self.size]
+        self.parts.append(text)
+        self.size += len(text) + 1
+
+    def finish(self) -> str:
+        tail = self.pending + self.decoder.decode(b"", final=True)
+        self.pending = ""
+        if tail and not self.done:
+            self.add_line(tail)
+        return "\n".join(self.parts).strip()
+
+class HtmlExtractor(TextExtractor):
+    """Collects raw markup (up to DOCUMENT_HTML_MAX_CHARS) for the existing HTML extraction"""
+    kind = "html"
+
+    def __init__(self, max_chars: int, charset: str = "utf-8"):
+        super().__init__(DOCUMENT_HTML_MAX_CHARS, charset)
+
+    def feed(self, chunk: bytes):
+        self.emit(self.decoder.decode(chunk))
+
+    def emit(self, text: str):
+        if not self.done:
+            text = text[:self.max_chars - self.size]
+            self.parts.append(text)
+            self.size += len(text)
+
+    def finish(self) -> str:
+        self.emit(self.decoder.decode(b"", final=True))
+        return "".join(self.parts)
+
+class MarkdownExtractor(TextExtractor):
+    """Plain text from Markdown: headings, emphasis, links and code fences are unwrapped"""
+    kind = "markdown"
+
+    def add_line(self, line: str):
+        stripped = line.strip()
+        if stripped.startswith(("```", "~~~")):
+            return
+        if stripped.startswith("#"):
+            stripped = stripped.lstrip("#").strip()
+            if self.title is None and stripped:
+                self.title = stripped
+        stripped = _MD_LINK_RE.sub(r'\1', stripped)
+        stripped = _MD_EMPHASIS_RE.sub(r'\2', stripped)
+        self.emit(stripped)
+
+class JsonExtractor(TextExtractor):
+    """Flattens JSON into "path: value" lines; reads at most a few times max_chars of input"""
+    kind = "json"
+
+    @property
+    def done(self) -> bool:
+        return self.size >= self.max_chars * 4
+
+    def feed(self, chunk: bytes):
+        text = self.decoder.decode(chunk)
+        self.parts.append(text)
+        self.size += len(text)
+
+    def finish(self) -> str:
+        raw = "".join(self.parts) + self.decoder.decode(b"", final=True)
+        try:
+            data = json.loads(raw)
+        except json.JSONDecodeError:
+            try:
+                # Cut off at the budget: close the open structures like truncated LLM output
+                data, _ = parse_llm_json(raw)
+            except json.JSONDecodeError:
+                return raw[:self.max_chars]
+        if isinstance(data, dict):
+            title = data.get("title") or data.get("name")
+            self.title = title if isinstance(title, str) else None
+        lines = []
+        size = 0
+        stack = [("", data)]
+        while stack and size < self.max_chars:
+            path, value = stack.pop()
+            if isinstance(value, dict):
+                stack.extend((f"{path}.{key}" if path else str(key), item) for key, item in reversed(list(value.items())))
+            elif isinstance(value, list):
+                stack.extend((f"{path}[{index}]", item) for index, item in reversed(list(enumerate(value))))
+            elif value is not None:
+                line = f"{path}: {value}" if path else str(value)
+                lines.append(line)
+                size += len(line) + 1
+        return "\n".join(lines)[:self.max_chars]
+
+def decode_pdf_string(token: bytes) -> str:
+    """Text of a PDF literal or hex string token; empty for glyph ids of embedded fonts"""
+    if token.startswith(b"<"):
+        try:
+            data = bytes.fromhex(token[1:-1].decode('ascii'))
+        except ValueError:
+            return ""
+    else:
+        def unescape_match(match):
+            seq = match.group(1)
+            if seq[:1].isdigit():
+                return bytes([int(seq, 8) & 0xFF])
+            if seq[:1] in b"\r\n":
+                return b""
+            return {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}.get(seq, seq)
+        data = _PDF_ESCAPE_RE.sub(unescape_match, token[1:-1])
+    if data.startswith(b"\xfe\xff"):
+        return data[2:].decode('utf-16-be', errors='ignore')
+    text = data.decode('latin-1')
+    # Two-byte CID strings decode to control characters; those need the font's ToUnicode map
+    printable = sum(1 for ch in text if ch.isprintable() or ch.isspace())
+    return text if text and printable / len(text) > 0.9 else ""
+
+class PdfExtractor(TextExtractor):
+    """Streaming text extraction from PDF content streams.
+
+    Inflates each stream as it arrives and reads the text-showing operators
+    (Tj, TJ, ', "), so text is available long before the file ends and
+    memory stays bounded by the largest content stream. Fonts, images and
+    other binary streams are skipped without being buffered. PDFs whose fonts need ToUnicode maps yield
+    little text; if pypdf is installed it is used for those instead.
+    """
+    kind = "pdf"
+
+    def __init__(self, max_chars: int, charset: str = "utf-8"):
+        super().__init__(max_chars)
+        self.buffer = bytearray()
+        self.skipping = False  # inside a stream too large to buffer
+        self.stream = None  # (header, data offset) of the stream being buffered
+        self.scanned = 0  # buffer offset the search for endstream resumes from
+        self.line = []
+        self.kept = bytearray() if HAVE_PYPDF else None
+
+    def feed(self, chunk: bytes):
+        if self.kept is not None:
+            if len(self.kept) + len(chunk) <= PDF_FALLBACK_MAX_BYTES:
+                self.kept += chunk
+            else:
+                self.kept = None
+        self.buffer += chunk
+        while not self.done:
+            if self.skipping:
+                end = self.buffer.find(b"endstream")
+                if end < 0:
+                    del self.buffer[:-16]
+                    return
+                del self.buffer[:end + 9]
+                self.skipping = False
+                continue
+            if self.stream is None:
+                match = _PDF_STREAM_RE.search(self.buffer)
+                if match is None:
+                    self.scan_title(self.buffer)
+                    # Keep enough to see a stream dictionary that straddles chunks
+                    del self.buffer[:-4096]
+                    return
+                header_start = max(self.buffer.rfind(b"obj", 0, match.start()), match.start() - 4096, 0)
+                header = bytes(self.buffer[header_start:match.start()])
+                self.scan_title(self.buffer[:match.start()])
+                if _PDF_SKIP_STREAM_RE.search(header):
+                    # Images, fonts and other binary streams are passed over, never buffered
+                    del self.buffer[:match.end()]
+                    self.skipping = True
+                    continue
+                self.stream = (header, match.end())
+                self.scanned = match.end()
+            header, start = self.stream
+            # Only the bytes that arrived since the last chunk are searched, so a large
+            # stream costs linear rather than quadratic time
+            end = self.buffer.find(b"endstream", self.scanned)
+            if end < 0:
+                if len(self.buffer) - start > PDF_MAX_STREAM_BYTES:
+                    del self.buffer[:start]
+                    self.stream = None
+                    self.skipping = True
+                    continue
+                self.scanned = max(start, len(self.buffer) - 8)
+                return  # wait for the rest of this stream
+            with memoryview(self.buffer) as view:
+                data = bytes(view[start:end])
+            del self.buffer[:end + 9]
+            self.stream = None
+            self.read_content_stream(header, data)
+
+    def scan_title(self, data: bytes):
+        if self.title is None:
+            match = _PDF_TITLE_RE.search(data)
+            if match:
+                self.title = decode_pdf_string(b"(" + match.group(1) + b")").strip() or None
+
+    def read_content_stream(self, header: bytes, data: bytes):
+        if b"/FlateDecode" in header or b"/Fl " in header or b"/Fl]" in header:
+            try:
+                data = zlib.decompressobj().decompress(data, PDF_MAX_INFLATED_BYTES)
+            except zlib.error:
+                return
+        elif b"/Filter" in header:
+            return
+        for match in _PDF_TEXT_OP_RE.finditer(data):
+            if self.done:
+                return
+            op = match.group(0)
+            if match.group(1) is not None:
+                # Td/TD: a vertical move starts a new line, a horizontal one a new word
+                if float(match.group(2) or 0) != 0:
+                    self.break_line()
+                elif self.line:
+                    self.line.append(" ")
+            elif op in (b"T*", b"ET"):
+                self.break_line()
+            elif op.startswith(b"["):
+                for token in _PDF_STRING_RE.findall(op[1:op.rfind(b"]")]):
+                    if token[:1] in b"(<":
+                        self.line.append(decode_pdf_string(token))
+                    elif float(token) < -200:
+                        self.line.append(" ")  # a large kern is a word gap
+            else:
+                if op.endswith((b"'", b'"')):
+                    self.break_line()
+                self.line.append(decode_pdf_string(op[:op.rfind(b")") + 1]))
+
+    def break_line(self):
+        text = " ".join("".join(self.line).split())
+        self.line = []
+        if text:
+            self.emit(text)
+
+    def finish(self) -> str:
+        self.break_line()
+        text = "\n".join(self.parts).strip()
+        if len(text) < 200 and self.kept:
+            text = self.extract_with_pypdf(bytes(self.kept)) or text
+        self.kept = None
+        return text
+
+    def extract_with_pypdf(self, data: bytes) -> str:
+        import io
+        from pypdf import PdfReader
+        try:
+            reader = PdfReader(io.BytesIO(data))
+            pages = []
+            size = 0
+            for page in reader.pages:
+                page_text = page.extract_text() or ""
+                pages.append(page_text)
+                size += len(page_text)
+                if size >= self.max_chars:
+                    break
+            if self.title is None and reader.metadata and reader.metadata.title:
+                self.title = reader.metadata.title
+            return "\n".join(pages)[:self.max_chars].strip()
+        except Exception as e:
+            logging.warning(f"pypdf extraction failed: {e}")
+            return ""
+
+DOCUMENT_EXTRACTORS = {
+    "html": HtmlExtractor,
+    "pdf": PdfExtractor,
+    "text": TextExtractor,
+    "markdown": MarkdownExtractor,
+    "json": JsonExtractor,
+}
+
+def document_kind(content_type: str, url: str) -> str:
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    path = urlsplit(url).path.lower()
+    if media_type == "application/pdf" or path.endswith(".pdf"):
+        return "pdf"
+    if media_type in ("text/markdown", "text/x-markdown") or path.endswith((".md", ".markdown")):
+        return "markdown"
+    if media_type == "application/json" or media_type.endswith("+json") or path.endswith(".json"):
+        return "json"
+    if media_type == "text/plain" or path.endswith(".txt"):
+        return "text"
+    return "html"
+
+async def fetch_document(url: str, max_chars: int):
+    """Fetch a URL and extract its text according to its content type; returns (kind, text, title).
+
+    The body is read incrementally and the download stops once max_chars of
+    text are extracted. For HTML, text is the raw markup, which callers run
+    through the HTML extraction they already have.
+    """
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
+    }
+    
+    async def consume(resp):
+        content_type = resp.headers.get("content-type", "")
+        charset_match = _CHARSET_RE.search(content_type)
+        charset = charset_match.group(1) if charset_match else (resp.encoding or "utf-8")
+        kind = document_kind(content_type, str(resp.url))
+        extractor = None
+        offload = kind == "pdf" or int(resp.headers.get("content-length") or 0) >= DOCUMENT_OFFLOAD_BYTES
+        async for chunk in resp.aiter_bytes():
+            if extractor is None:
+                # Servers often label PDFs as octet-stream or even text/html
+                if chunk.startswith(b"%PDF-"):
+                    kind, offload = "pdf", True
+                extractor = DOCUMENT_EXTRACTORS[kind](max_chars, charset)
+            if offload:
+                await asyncio.to_thread(extractor.feed, chunk)
+            else:
+                extractor.feed(chunk)
+            if extractor.done:
+                break
+        if extractor is None:
+            extractor = DOCUMENT_EXTRACTORS[kind](max_chars, charset)
+        text = await asyncio.to_thread(extractor.finish) if offload else extractor.finish()
+        return kind, text, extractor.title
+    
+    _, (kind, text, title) = await fetch_page(url, headers, consume=consume)
+    return kind, text, title
+
+def document_reader_data(page_url: str, kind: str, text: str, title: Optional[str]) -> dict:
+    """Reader-mode payload for a non-HTML document; no LLM pass is needed for these"""
+    labels = {"pdf": "PDF document", "text": "Text document", "markdown": "Markdown document", "json": "JSON document"}
+    if not title:
+        title = urlsplit(page_url).path.rstrip("/").rsplit("/", 1)[-1] or "Untitled"
+    # Blank lines separate paragraphs; single line breaks inside them are layout
+    paragraphs = [" ".join(block.split()) for block in _BLANK_LINE_RE.split(text)] if kind != "pdf" else text.split("\n")
+    return {
+        "title": title[:200],
+        "content": "\n\n".join(p for p in paragraphs if p)[:READER_MAX_CHARS],
+        "summary": f"{labels.get(kind, 'Document')} extracted from {page_url}"
+    }
+
 # ============ PAGE SUMMARIZER ENDPOINT ============
 
 @api_router.post("/summarize_page")
 async def summarize_page(request: Request, session_token: Optional[str] = Cookie(None)):
     """Summarize page content using AI"""
     user = await get_optional_user(request, session_token)
-    user_id = user.user_id if user else get_guest_user_id()
+    user_id = user.user_id if user else await get_guest_user_id(request)
     
-    if 'ai_client' not in globals():
+    if not llm_router.providers:
         raise HTTPException(status_code=503, detail="AI service not configured (A4F_API_KEY missing)")
     
     try:
@@ -676,34 +3107,42 @@ async def summarize_page(request: Request, session_token: Optional[str] = Cookie
         if not page_url and not page_content:
             raise HTTPException(status_code=400, detail="Either URL or content is required")
         
-        # If only URL provided, fetch the content
+        # URL-only summaries are cached compressed and served without re-compressing
+        summary_cache_key = page_url if page_url and not page_content else None
+        if summary_cache_key:
+            cached = _summary_cache.get(summary_cache_key)
+            if cached:
+                return gzip_response(request, *cached)
+        
+        # If only URL provided, fetch the content (PDFs and other documents are extracted as text)
+        content_kind = "html"
         if page_url and not page_content:
-            async with httpx.AsyncClient(follow_redirects=True, timeout=30.0) as client:
-                try:
-                    headers = {
-                        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
-                    }
-                    resp = await client.get(page_url, headers=headers)
-                    page_content = resp.text
-                except Exception as e:
-                    logging.error(f"Failed to fetch page content: {e}")
-                    raise HTTPException(status_code=400, detail=f"Failed to fetch page content: {str(e)}")
-        
-        # Extract text content (basic HTML stripping)
-        import re
-        from html import unescape
-        # Remove script and style elements
-        page_content = re.sub(r'<script[^>]*>.*?</script>', '', page_content, flags=re.DOTALL | re.IGNORECASE)
-        page_content = re.sub(r'<style[^>]*>.*?</style>', '', page_content, flags=re.DOTALL | re.IGNORECASE)
-        # Remove HTML tags
-        text = re.sub(r'<[^>]+>', ' ', page_content)
-        # Decode HTML entities
-        text = unescape(text)
+            try:
+                content_kind, page_content, document_title = await fetch_document(page_url, SUMMARY_MAX_CHARS)
+            except OriginUnavailable as e:
+                raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+            except Exception as e:
+                logging.error(f"Failed to fetch page content: {e}")
+                raise HTTPException(status_code=400, detail=f"Failed to fetch page content: {str(e)}")
+            if document_title and 'title' not in body:
+                page_title = document_title
+        
+        if content_kind == "html":
+            # Extract text content (basic HTML stripping)
+            # Remove script and style elements
+            page_content = _SCRIPT_RE.sub('', page_content)
+            page_content = _STYLE_RE.sub('', page_content)
+            # Remove HTML tags
+            text = _TAG_RE.sub(' ', page_content)
+            # Decode HTML entities
+            text = unescape(text)
+        else:
+            text = page_content
         # Clean up whitespace
         text = ' '.join(text.split())
         
         # Limit content length for API
-        max_chars = 8000
+        max_chars = SUMMARY_MAX_CHARS
         if len(text) > max_chars:
             text = text[:max_chars] + "..."
         
@@ -732,21 +3171,7 @@ Format your response as JSON with this structure:
 
 Return ONLY the JSON object, no markdown formatting."""
 
-        response = ai_client.chat.completions.create(
-            model=A4F_MODEL,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        
-        response_text = response.choices[0].message.content.strip()
-        
-        # Remove markdown code blocks if present
-        if response_text.startswith('```'):
-            lines = response_text.split('\n')
-            response_text = '\n'.join(lines[1:-1]) if len(lines) > 2 else response_text
-            response_text = response_text.replace('```json', '').replace('```', '').strip()
-        
-        import json
-        summary_data = json.loads(response_text)
+        summary_data = await generate_structured(prompt, PageSummary)
         
         # Store summary in database (optional)
         summary_doc = {
@@ -757,66 +3182,184 @@ Return ONLY the JSON object, no markdown formatting."""
             "summary": summary_data,
             "created_at": datetime.now(timezone.utc).isoformat()
         }
-        await db.page_summaries.insert_one(summary_doc)
+        await get_db().page_summaries.insert_one(summary_doc)
+        
+        if summary_cache_key:
+            _summary_cache.set(summary_cache_key, gzip.compress(json.dumps(summary_data).encode('utf-8')), "application/json")
         
         return summary_data
         
-    except json.JSONDecodeError as e:
-        logging.error(f"JSON parse error in summarize_page: {e}. Response: {response_text[:500]}")
+    except HTTPException:
+        raise
+    except StructuredOutputError as e:
         return JSONResponse(
             status_code=400,
-            content={"error": "Failed to parse AI response", "raw_response": response_text[:500]}
+            content={"error": "Failed to parse AI response", "raw_response": e.raw_response[:500]}
         )
     except Exception as e:
         logging.error(f"Page summarization error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ============ READER SNAPSHOT STORE ============
+
+# Strong references to in-flight background refreshes, keyed by URL
+_snapshot_refreshes = {}
+
+def normalize_page_url(page_url: str) -> str:
+    """Add a protocol to bare URLs (http for localhost, https otherwise)"""
+    is_localhost = 'localhost' in page_url.lower() or '127.0.0.1' in page_url
+    if not page_url.startswith('http'):
+        protocol = 'http://' if is_localhost else 'https://'
+        page_url = protocol + page_url
+    return page_url
+
+def _snapshot_blob_path(digest: str) -> Path:
+    return SNAPSHOT_DIR / digest[:2] / f"{digest}.gz"
+
+def _write_snapshot_blob(data: bytes) -> str:
+    """Store bytes gzip-compressed under their sha256 and return the hash"""
+    digest = hashlib.sha256(data).hexdigest()
+    path = _snapshot_blob_path(digest)
+    if path.exists():
+        # Reused blobs restart their grace period so the sweep can't race the snapshot doc
+        os.utime(path)
+    else:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{digest}.{uuid.uuid4().hex[:8]}.tmp")
+        tmp_path.write_bytes(gzip.compress(data))
+        os.replace(tmp_path, path)
+    return digest
+
+def _read_snapshot_blob(digest: str) -> Optional[bytes]:
+    try:
+        return gzip.decompress(_snapshot_blob_path(digest).read_bytes())
+    except (OSError, EOFError):
+        return None
+
+async def save_reader_snapshot(page_url: str, reader_data: dict, html_content: Optional[str] = None):
+    """Persist extracted reader content, deduplicated by content hash.
+
+    Best-effort: the snapshot store is a cache (SNAPSHOT_DIR may be read-only,
+    e.g. on serverless hosts), so failures are logged rather than raised.
+    """
+    payload = {
+        "title": reader_data.get("title", ""),
+        "content": reader_data.get("content", ""),
+        "summary": reader_data.get("summary", "")
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    try:
+        content_hash = await asyncio.to_thread(_write_snapshot_blob, encoded)
+        snapshot_doc = {
+            "url": page_url,
+            "title": payload["title"],
+            "content_hash": content_hash,
+            "fetched_at": datetime.now(timezone.utc).isoformat()
+        }
+        if SNAPSHOT_STORE_HTML and html_content:
+            snapshot_doc["html_hash"] = await asyncio.to_thread(_write_snapshot_blob, html_content.encode('utf-8'))
+        await get_db().reader_snapshots.update_one({"url": page_url}, {"$set": snapshot_doc}, upsert=True)
+    except Exception as e:
+        logging.warning(f"Saving reader snapshot for {page_url} failed: {e}")
+
+def _sweep_snapshot_blobs(referenced: set) -> int:
+    """Delete blobs (and abandoned temp files) outside the referenced set and past the grace period"""
+    removed = 0
+    cutoff = time.time() - SNAPSHOT_GC_GRACE
+    for path in SNAPSHOT_DIR.glob("*/*"):
+        digest = path.name.split(".", 1)[0]
+        if path.suffix == ".gz" and digest in referenced:
+            continue
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+async def purge_unreferenced_snapshot_blobs() -> int:
+    """Remove blobs no reader_snapshots document points at any more (replaced by a refresh, or never recorded)"""
+    referenced = set()
+    async for doc in get_db().reader_snapshots.find({}, {"_id": 0, "content_hash": 1, "html_hash": 1}):
+        referenced.update(doc[key] for key in ("content_hash", "html_hash") if doc.get(key))
+    return await asyncio.to_thread(_sweep_snapshot_blobs, referenced)
+
+async def purge_unreferenced_snapshot_blobs_periodically():
+    while True:
+        try:
+            removed = await purge_unreferenced_snapshot_blobs()
+            if removed:
+                logging.info(f"Removed {removed} unreferenced snapshot blobs")
+        except Exception as e:
+            logging.error(f"Snapshot blob cleanup failed: {e}")
+        await asyncio.sleep(SNAPSHOT_GC_INTERVAL)
+
+async def load_reader_snapshot(page_url: str):
+    """Return (reader_data, fetched_at) for the latest snapshot of a URL, or None"""
+    snapshot_doc = await get_db().reader_snapshots.find_one({"url": page_url}, {"_id": 0})
+    if not snapshot_doc:
+        return None
+    data = await asyncio.to_thread(_read_snapshot_blob, snapshot_doc["content_hash"])
+    if data is None:
+        return None
+    fetched_at = snapshot_doc["fetched_at"]
+    if isinstance(fetched_at, str):
+        fetched_at = datetime.fromisoformat(fetched_at)
+    if fetched_at.tzinfo is None:
+        fetched_at = fetched_at.replace(tzinfo=timezone.utc)
+    return json.loads(data), fetched_at
+
+async def refresh_reader_snapshot(page_url: str):
+    """Re-extract a page and store a fresh snapshot"""
+    try:
+        reader_data, html_content = await extract_reader_content(page_url)
+        await save_reader_snapshot(page_url, reader_data, html_content)
+    except Exception as e:
+        logging.warning(f"Snapshot refresh failed for {page_url}: {getattr(e, 'detail', e)}")
+    finally:
+        _snapshot_refreshes.pop(page_url, None)
+
+def schedule_snapshot_refresh(page_url: str):
+    """Refresh a snapshot in the background, at most once concurrently per URL"""
+    if page_url in _snapshot_refreshes:
+        return
+    _snapshot_refreshes[page_url] = asyncio.create_task(refresh_reader_snapshot(page_url))
+
 # ============ READER MODE ENDPOINT ============
 
-@api_router.post("/reader_mode")
-async def reader_mode(request: Request, session_token: Optional[str] = Cookie(None)):
-    """Extract clean readable content from a webpage using AI"""
-    user = await get_optional_user(request, session_token)
+async def extract_reader_content(page_url: str, html_content: Optional[str] = None):
+    """Extract readable content, fetching the page unless its HTML is given; returns (reader_data, html).
+
+    Non-HTML documents (PDF, text, Markdown, JSON) are extracted directly and return html=None.
+    """
+    import httpx
     
-    try:
-        body = await request.json()
-        page_url = body.get('url')
-        
-        if not page_url:
-            raise HTTPException(status_code=400, detail="URL is required")
-        
-        # Handle localhost URLs
-        is_localhost = 'localhost' in page_url.lower() or '127.0.0.1' in page_url
-        if not page_url.startswith('http'):
-            protocol = 'http://' if is_localhost else 'https://'
-            page_url = protocol + page_url
+    # Fetch page content
+    if html_content is None:
+        try:
+            kind, html_content, title = await fetch_document(page_url, READER_MAX_CHARS)
+        except OriginUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+        except httpx.ConnectError:
+            raise HTTPException(status_code=503, detail=f"Connection refused. Make sure the server at {page_url} is running.")
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Failed to fetch page: {str(e)}")
+        if kind != "html":
+            return document_reader_data(page_url, kind, html_content, title), None
+    raw_html = html_content
+    
+    # Basic cleanup
+    html_content = _SCRIPT_RE.sub('', html_content)
+    html_content = _STYLE_RE.sub('', html_content)
+    
+    # Extract readable content using AI
+    if llm_router.providers:
         
-        # Fetch page content
-        async with httpx.AsyncClient(follow_redirects=True, timeout=30.0) as client:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
-            }
-            try:
-                resp = await client.get(page_url, headers=headers)
-                html_content = resp.text
-            except httpx.ConnectError:
-                raise HTTPException(status_code=503, detail=f"Connection refused. Make sure the server at {page_url} is running.")
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Failed to fetch page: {str(e)}")
+        # Limit HTML for AI processing
+        html_sample = html_content[:12000]
         
-        # Extract readable content using AI
-        if 'ai_client' in globals():
-            import re
-            from html import unescape
-            
-            # Basic cleanup
-            html_content = re.sub(r'<script[^>]*>.*?</script>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-            html_content = re.sub(r'<style[^>]*>.*?</style>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-            
-            # Limit HTML for AI processing
-            html_sample = html_content[:12000]
-            
-            prompt = f"""Extract the main readable content from this HTML page. Return ONLY a JSON object with:
+        prompt = f"""Extract the main readable content from this HTML page. Return ONLY a JSON object with:
 {{
   "title": "Page title",
   "content": "Clean readable text content with proper paragraphs separated by double newlines",
@@ -827,86 +3370,140 @@ HTML Content:
 {html_sample}
 
 Return ONLY the JSON, no markdown, no backticks."""
-            
-            try:
-                response = ai_client.chat.completions.create(
-                    model=A4F_MODEL,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                
-                response_text = response.choices[0].message.content.strip()
-                if response_text.startswith('```'):
-                    lines = response_text.split('\n')
-                    response_text = '\n'.join(lines[1:-1]) if len(lines) > 2 else response_text
-                    response_text = response_text.replace('```json', '').replace('```', '').strip()
-                
-                import json
-                reader_data = json.loads(response_text)
-                return reader_data
-            except Exception as e:
-                logging.error(f"AI reader extraction failed: {e}, falling back to basic extraction")
-        
-        # Fallback to basic extraction (no BeautifulSoup needed)
-        from html import unescape
-        import re
-        
-        # Remove scripts and styles
-        html_content = re.sub(r'<script[^>]*>.*?</script>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-        html_content = re.sub(r'<style[^>]*>.*?</style>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-        
-        # Extract title
-        title_match = re.search(r'<title[^>]*>(.*?)</title>', html_content, re.IGNORECASE | re.DOTALL)
-        title = title_match.group(1).strip() if title_match else 'Untitled'
-        title = re.sub(r'<[^>]+>', '', title)
-        title = unescape(title)
-        
-        # Remove nav, footer, header, aside
-        html_content = re.sub(r'<nav[^>]*>.*?</nav>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-        html_content = re.sub(r'<footer[^>]*>.*?</footer>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-        html_content = re.sub(r'<header[^>]*>.*?</header>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-        html_content = re.sub(r'<aside[^>]*>.*?</aside>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-        
-        # Try to extract main content areas
-        article_match = re.search(r'<article[^>]*>(.*?)</article>', html_content, re.IGNORECASE | re.DOTALL)
-        main_match = re.search(r'<main[^>]*>(.*?)</main>', html_content, re.IGNORECASE | re.DOTALL)
-        body_match = re.search(r'<body[^>]*>(.*?)</body>', html_content, re.IGNORECASE | re.DOTALL)
-        
-        content_html = article_match.group(1) if article_match else (main_match.group(1) if main_match else (body_match.group(1) if body_match else html_content))
-        
-        # Extract paragraphs and headings
-        paragraphs = []
-        for tag in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p']:
-            matches = re.findall(rf'<{tag}[^>]*>(.*?)</{tag}>', content_html, re.IGNORECASE | re.DOTALL)
-            for match in matches:
-                text = re.sub(r'<[^>]+>', ' ', match)
-                text = unescape(text)
-                text = ' '.join(text.split())
-                if len(text) > 20:
-                    paragraphs.append(text)
-        
-        # If no paragraphs found, extract all text
-        if not paragraphs:
-            text = re.sub(r'<[^>]+>', ' ', content_html)
+        
+        try:
+            reader_data = await generate_structured(prompt, ReaderContent)
+            return reader_data, raw_html
+        except Exception as e:
+            logging.error(f"AI reader extraction failed: {e}, falling back to basic extraction")
+    
+    # Fallback to basic extraction (no BeautifulSoup needed)
+    
+    # Extract title
+    title_match = _TITLE_RE.search(html_content)
+    title = title_match.group(1).strip() if title_match else 'Untitled'
+    title = _TAG_RE.sub('', title)
+    title = unescape(title)
+    
+    # Remove nav, footer, header, aside
+    for boilerplate_re in _BOILERPLATE_RES:
+        html_content = boilerplate_re.sub('', html_content)
+    
+    # Try to extract main content areas
+    article_match = _ARTICLE_RE.search(html_content)
+    main_match = _MAIN_RE.search(html_content)
+    body_match = _BODY_RE.search(html_content)
+    
+    content_html = article_match.group(1) if article_match else (main_match.group(1) if main_match else (body_match.group(1) if body_match else html_content))
+    
+    # Extract paragraphs and headings
+    paragraphs = []
+    for block_re in _BLOCK_RES:
+        for match in block_re.findall(content_html):
+            text = _TAG_RE.sub(' ', match)
             text = unescape(text)
             text = ' '.join(text.split())
-            paragraphs = [p.strip() for p in text.split('. ') if len(p.strip()) > 50]
+            if len(text) > 20:
+                paragraphs.append(text)
+    
+    # If no paragraphs found, extract all text
+    if not paragraphs:
+        text = _TAG_RE.sub(' ', content_html)
+        text = unescape(text)
+        text = ' '.join(text.split())
+        paragraphs = [p.strip() for p in text.split('. ') if len(p.strip()) > 50]
+    
+    content = '\n\n'.join(paragraphs[:100])  # Limit to 100 paragraphs
+    
+    reader_data = {
+        "title": title[:200],
+        "content": content[:50000],  # Limit content
+        "summary": f"Content extracted from {page_url}"
+    }
+    return reader_data, raw_html
+
+@api_router.post("/reader_mode")
+async def reader_mode(request: Request, session_token: Optional[str] = Cookie(None)):
+    """Extract clean readable content from a webpage, served from the snapshot store when available"""
+    user = await get_optional_user(request, session_token)
+    
+    try:
+        body = await request.json()
+        page_url = body.get('url')
+        
+        if not page_url:
+            raise HTTPException(status_code=400, detail="URL is required")
         
-        content = '\n\n'.join(paragraphs[:100])  # Limit to 100 paragraphs
+        page_url = normalize_page_url(page_url)
         
-        return {
-            "title": title[:200],
-            "content": content[:50000],  # Limit content
-            "summary": f"Content extracted from {page_url}"
-        }
+        # Serve the stored snapshot immediately; refresh stale ones in the background
+        if not body.get('refresh'):
+            snapshot = await load_reader_snapshot(page_url)
+            if snapshot:
+                reader_data, fetched_at = snapshot
+                if datetime.now(timezone.utc) - fetched_at > SNAPSHOT_REFRESH_AFTER:
+                    schedule_snapshot_refresh(page_url)
+                return reader_data
+        
+        reader_data, html_content = await extract_reader_content(page_url)
+        await save_reader_snapshot(page_url, reader_data, html_content)
+        return reader_data
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Reader mode error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # ============ PROXY ENDPOINT ============
 
+async def fetch_proxied(url: str, max_bytes: Optional[int] = None):
+    """Fetch a page the way /api/proxy serves it; returns (body, media_type, content_encoding, html, wire_bytes).
+
+    The body is gzip-compressed unless the origin used an encoding we pass
+    through untouched. html is the rewritten page text for HTML responses.
+    wire_bytes is the size of the body as the origin sent it.
+    Successful responses are stored in the proxy cache.
+    """
+    # Add some headers to mimic a browser
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+        "Accept-Language": "en-US,en;q=0.5",
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+        "Upgrade-Insecure-Requests": "1"
+    }
+    
+    # Read the raw (still encoded) body so unmodified responses can pass through compressed
+    resp, raw_body = await fetch_page(url, headers, raw=True, max_bytes=max_bytes)
+    
+    media_type = resp.headers.get("content-type", "text/html")
+    upstream_encoding = resp.headers.get("content-encoding", "identity").strip().lower()
+    
+    if upstream_encoding not in ('gzip', 'deflate', 'identity'):
+        return raw_body, media_type, upstream_encoding, None, len(raw_body)
+    
+    content = None
+    if 'html' in media_type:
+        content = decode_content_encoding(raw_body, upstream_encoding).decode(resp.encoding or 'utf-8', errors='replace')
+        # Simple base tag injection to help with relative links
+        if "<head>" in content:
+            content = content.replace("<head>", f'<head><base href="{url}">')
+        elif "<html>" in content:
+            content = content.replace("<html>", f'<html><head><base href="{url}"></head>')
+        gzip_body = gzip.compress(content.encode('utf-8'), compresslevel=6)
+    elif upstream_encoding == 'gzip':
+        gzip_body = raw_body
+    else:
+        gzip_body = gzip.compress(decode_content_encoding(raw_body, upstream_encoding), compresslevel=6)
+    
+    if resp.status_code == 200:
+        _proxy_cache.set(url, gzip_body, media_type)
+    return gzip_body, media_type, "gzip", content, len(raw_body)
+
 @api_router.get("/proxy")
-async def proxy(url: str):
+async def proxy(url: str, request: Request, session_token: Optional[str] = Cookie(None)):
     if not url:
         raise HTTPException(status_code=400, detail="URL required")
     
@@ -921,48 +3518,225 @@ async def proxy(url: str):
         # Convert https localhost to http
         url = url.replace('https://', 'http://')
     
-    async with httpx.AsyncClient(follow_redirects=True, timeout=30.0) as client:
-        try:
-            # Add some headers to mimic a browser
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-                "Accept-Language": "en-US,en;q=0.5",
-                "Accept-Encoding": "gzip, deflate",
-                "Connection": "keep-alive",
-                "Upgrade-Insecure-Requests": "1"
-            }
-            
-            resp = await client.get(url, headers=headers)
+    cached = _proxy_cache.get(url)
+    if cached:
+        if 'html' in cached[1]:
+            schedule_prefetch(request, session_token, url, gzip_body=cached[0])
+        return gzip_response(request, *cached)
+    
+    import httpx
+    
+    try:
+        body, media_type, content_encoding, html, _ = await fetch_proxied(url)
+        if content_encoding != "gzip":
+            return Response(content=body, media_type=media_type, headers={"Content-Encoding": content_encoding})
+        if html is not None:
+            schedule_prefetch(request, session_token, url, html=html)
+        return gzip_response(request, body, media_type)
+    except OriginUnavailable as e:
+        return Response(
+            content=f'<html><head><title>Connection Error</title></head><body style="font-family: Arial, sans-serif; padding: 40px; background: #1a1a1a; color: #fff;"><h1>Connection Error</h1><p>{e}</p><p style="color: #888;">Retrying in {e.retry_after}s.</p></body></html>',
+            media_type="text/html",
+            status_code=503,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except httpx.ConnectError as e:
+        error_msg = f"Connection refused. Make sure the server at {url} is running and accessible."
+        return Response(
+            content=f'<html><head><title>Connection Error</title></head><body style="font-family: Arial, sans-serif; padding: 40px; background: #1a1a1a; color: #fff;"><h1>Connection Error</h1><p>{error_msg}</p><p style="color: #888;">If you are trying to access localhost, ensure the server is running on the specified port.</p></body></html>',
+            media_type="text/html",
+            status_code=503
+        )
+    except httpx.TimeoutException:
+        return Response(
+            content='<html><head><title>Timeout</title></head><body style="font-family: Arial, sans-serif; padding: 40px; background: #1a1a1a; color: #fff;"><h1>Request Timeout</h1><p>The request to load the page took too long.</p></body></html>',
+            media_type="text/html",
+            status_code=504
+        )
+    except Exception as e:
+        error_msg = str(e)
+        return Response(
+            content=f'<html><head><title>Error</title></head><body style="font-family: Arial, sans-serif; padding: 40px; background: #1a1a1a; color: #fff;"><h1>Error loading page</h1><p>{error_msg}</p></body></html>',
+            media_type="text/html",
+            status_code=500
+        )
+
+# ============ LINK PREFETCHER ============
+
+class PrefetchBudget:
+    """Per-user concurrency, rolling one-minute bandwidth budget and hourly reader budget for prefetches"""
+    def __init__(self):
+        self.slots = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+        self.transfers = deque()  # (monotonic time, bytes)
+        self.reader_warmups = deque()  # monotonic times of reader extractions
+        self.task = None
+        self.warmed = OrderedDict()  # url -> monotonic time it was warmed
+
+    def remaining_bytes(self) -> int:
+        cutoff = time.monotonic() - 60
+        while self.transfers and self.transfers[0][0] < cutoff:
+            self.transfers.popleft()
+        return PREFETCH_BYTES_PER_MINUTE - sum(size for _, size in self.transfers)
+
+    def spend(self, size: int):
+        self.transfers.append((time.monotonic(), size))
+
+    def take_reader_warmup(self) -> bool:
+        """Claim one of the hour's reader extractions, or return False when they are used up"""
+        now = time.monotonic()
+        while self.reader_warmups and self.reader_warmups[0] < now - 3600:
+            self.reader_warmups.popleft()
+        if len(self.reader_warmups) >= PREFETCH_READER_PER_HOUR:
+            return False
+        self.reader_warmups.append(now)
+        return True
+
+class LinkPrefetcher:
+    """Warms the proxy cache (and reader snapshots) for the links a user is most likely to open next"""
+    def __init__(self):
+        self.users = OrderedDict()  # user_id -> PrefetchBudget
+        self.stats = {"navigations": 0, "prefetched": 0, "hits": 0, "cancelled": 0, "overBudget": 0, "failed": 0,
+                      "readerWarmed": 0, "readerOverBudget": 0}
+
+    def budget(self, user_id: str) -> PrefetchBudget:
+        budget = self.users.get(user_id)
+        if budget is None:
+            budget = self.users[user_id] = PrefetchBudget()
+            while len(self.users) > PREFETCH_TRACKED_USERS:
+                _, evicted = self.users.popitem(last=False)
+                if evicted.task:
+                    evicted.task.cancel()
+        self.users.move_to_end(user_id)
+        return budget
+
+    def navigated(self, user_id: str, url: str):
+        """Count a page view against earlier prefetches and cancel prefetching for the previous page"""
+        budget = self.users.get(user_id)
+        if budget is None:
+            return
+        self.stats["navigations"] += 1
+        warmed_at = budget.warmed.pop(url, None)
+        if warmed_at is not None and time.monotonic() - warmed_at < PROXY_CACHE_TTL:
+            self.stats["hits"] += 1
+        if budget.task and not budget.task.done():
+            budget.task.cancel()
+            self.stats["cancelled"] += 1
+
+    def rank_links(self, page_url: str, html: str, session: dict) -> List[str]:
+        """Links on the page ordered by relevance to the focus session topic"""
+        scored = {}
+        for href, anchor_html in _LINK_RE.findall(html[:PREFETCH_SCAN_CHARS]):
+            link = urljoin(page_url, unescape(href.strip()))
+            if not link.startswith(('http://', 'https://')) or link == page_url or _SKIP_LINK_RE.search(link):
+                continue
+            anchor = " ".join(unescape(_TAG_RE.sub(' ', anchor_html)).split())
+            # URL path words count too; many links are bare icons or "read more"
+            path_words = _URL_PATH_SEPARATORS_RE.sub(' ', urlsplit(link).path)
+            score, overlap = topic_match(session, f"{anchor} {path_words}", anchor)
+            score = max(score, overlap)
+            if score >= PREFETCH_MIN_SCORE and score > scored.get(link, 0):
+                scored[link] = score
+        return sorted(scored, key=scored.get, reverse=True)[:PREFETCH_LINKS]
+
+    def schedule(self, user_id: str, page_url: str, html: str, session: dict):
+        budget = self.budget(user_id)
+        links = self.rank_links(page_url, html, session)
+        if links:
+            budget.task = asyncio.create_task(self._run(budget, links))
+
+    async def _run(self, budget: PrefetchBudget, links: List[str]):
+        await asyncio.gather(*[
+            self._warm(budget, link, with_reader=rank < PREFETCH_READER_LINKS)
+            for rank, link in enumerate(links)
+        ])
+
+    async def _warm(self, budget: PrefetchBudget, url: str, with_reader: bool):
+        async with budget.slots:
+            html = None
+            if _proxy_cache.get(url) is None:
+                remaining = budget.remaining_bytes()
+                if remaining <= 0:
+                    self.stats["overBudget"] += 1
+                    return
+                max_bytes = min(PREFETCH_MAX_PAGE_BYTES, remaining)
+                try:
+                    _, _, _, html, wire_bytes = await fetch_proxied(url, max_bytes=max_bytes)
+                    budget.spend(wire_bytes)
+                except ResponseTooLarge:
+                    budget.spend(max_bytes)
+                    self.stats["overBudget"] += 1
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.debug(f"Prefetch of {url} failed: {e}")
+                    self.stats["failed"] += 1
+                    return
+                if _proxy_cache.get(url) is None:
+                    return  # not cacheable (non-200 or passed-through encoding)
+            budget.warmed[url] = time.monotonic()
+            while len(budget.warmed) > PREFETCH_LINKS * 10:
+                budget.warmed.popitem(last=False)
+            self.stats["prefetched"] += 1
             
-            content = resp.text
-            # Simple base tag injection to help with relative links
-            if "<head>" in content:
-                content = content.replace("<head>", f'<head><base href="{url}">')
-            elif "<html>" in content:
-                content = content.replace("<html>", f'<html><head><base href="{url}"></head>')
-                
-            return Response(content=content, media_type=resp.headers.get("content-type", "text/html"))
-        except httpx.ConnectError as e:
-            error_msg = f"Connection refused. Make sure the server at {url} is running and accessible."
-            return Response(
-                content=f'<html><head><title>Connection Error</title></head><body style="font-family: Arial, sans-serif; padding: 40px; background: #1a1a1a; color: #fff;"><h1>Connection Error</h1><p>{error_msg}</p><p style="color: #888;">If you are trying to access localhost, ensure the server is running on the specified port.</p></body></html>',
-                media_type="text/html",
-                status_code=503
-            )
-        except httpx.TimeoutException:
-            return Response(
-                content='<html><head><title>Timeout</title></head><body style="font-family: Arial, sans-serif; padding: 40px; background: #1a1a1a; color: #fff;"><h1>Request Timeout</h1><p>The request to load the page took too long.</p></body></html>',
-                media_type="text/html",
-                status_code=504
-            )
-        except Exception as e:
-            error_msg = str(e)
-            return Response(
-                content=f'<html><head><title>Error</title></head><body style="font-family: Arial, sans-serif; padding: 40px; background: #1a1a1a; color: #fff;"><h1>Error loading page</h1><p>{error_msg}</p></body></html>',
-                media_type="text/html",
-                status_code=500
-            )
+            if with_reader and html is not None:
+                snapshot = await load_reader_snapshot(url)
+                if snapshot is None or datetime.now(timezone.utc) - snapshot[1] > SNAPSHOT_REFRESH_AFTER:
+                    if not budget.take_reader_warmup():
+                        self.stats["readerOverBudget"] += 1
+                        return
+                    try:
+                        reader_data, raw_html = await extract_reader_content(url, html)
+                        await save_reader_snapshot(url, reader_data, raw_html)
+                        self.stats["readerWarmed"] += 1
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        logging.debug(f"Reader prefetch of {url} failed: {getattr(e, 'detail', e)}")
+
+    def metrics(self) -> dict:
+        prefetched = self.stats["prefetched"]
+        navigations = self.stats["navigations"]
+        return {
+            **self.stats,
+            "hitRate": round(self.stats["hits"] / prefetched, 3) if prefetched else None,
+            "coverage": round(self.stats["hits"] / navigations, 3) if navigations else None,
+            "activeUsers": len(self.users)
+        }
+
+link_prefetcher = LinkPrefetcher()
+
+async def prefetch_for_navigation(request: Request, session_token: Optional[str], page_url: str,
+                                  gzip_body: Optional[bytes] = None, html: Optional[str] = None):
+    """Called for every proxied HTML page: records the navigation and, for users who opted in
+    and have an active focus session, prefetches the page's most relevant links"""
+    try:
+        user = await get_optional_user(request, session_token)
+        # This runs after the response, too late to set a cookie, so browsers without an
+        # identity yet are skipped instead of minting a guest (and settings) on every page
+        user_id = user.user_id if user else await verify_guest_cookie(request.cookies.get(GUEST_COOKIE))
+        if user_id is None:
+            return
+        link_prefetcher.navigated(user_id, page_url)
+        settings = await load_settings(user_id)
+        if not settings.prefetch_links:
+            return
+        session = await load_active_focus_session(user_id)
+        if not session:
+            return
+        if html is None:
+            html = gzip.decompress(gzip_body).decode('utf-8', errors='replace')
+        link_prefetcher.schedule(user_id, page_url, html, session)
+    except Exception as e:
+        # Prefetching is best effort and must never break the page itself
+        logging.warning(f"Prefetch scheduling failed: {e}")
+
+def schedule_prefetch(request: Request, session_token: Optional[str], page_url: str,
+                      gzip_body: Optional[bytes] = None, html: Optional[str] = None):
+    """Run prefetch_for_navigation after the response, so pages are never delayed by it"""
+    task = asyncio.create_task(prefetch_for_navigation(request, session_token, page_url, gzip_body, html))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
 # ============ SUGGESTIONS PROXY ============
 
@@ -970,37 +3744,99 @@ async def proxy(url: str):
 async def get_suggestions(q: str):
     """Proxy Google suggestions to avoid CORS"""
     try:
-        async with httpx.AsyncClient() as client:
-            url = f"https://suggestqueries.google.com/complete/search?client=firefox&q={encodeURIComponent(q)}"
-            response = await client.get(url, timeout=5.0)
-            return response.json()
+        response = await get_http_client().get(
+            "https://suggestqueries.google.com/complete/search",
+            params={"client": "firefox", "q": q},
+            timeout=5.0
+        )
+        return response.json()
     except Exception as e:
         logging.error(f"Suggestions error: {e}")
         return [[], []]
 
 # ============ HEALTH CHECK ============
 
+@api_router.get("/llm/stats")
+async def llm_stats():
+    """Rolling latency, error rate and circuit state per LLM provider"""
+    return {
+        "providers": [p.stats() for p in llm_router.providers],
+        "structuredOutput": structured_output_metrics()
+    }
+
+@api_router.get("/prefetch/stats")
+async def prefetch_stats():
+    """Link prefetcher counters; hitRate is the share of prefetched pages that were then opened"""
+    return link_prefetcher.metrics()
+
+@api_router.get("/origins/stats")
+async def origin_stats():
+    """Latency, error rate, concurrency and circuit state per outbound origin"""
+    return {"origins": [health.stats() for health in reversed(_origins.values())]}
+
 @api_router.get("/")
 async def root():
     return {"message": "DeepBrowser API", "status": "ok"}
 
-# Include router
-app.include_router(api_router)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+async def create_indexes():
+    await get_db().reader_snapshots.create_index("url", unique=True)
+    await get_db().tombstones.create_index([("user_id", 1), ("deleted_at", 1)])
+    await get_db().tombstones.create_index("purge_at", expireAfterSeconds=0)
+    await get_db().guest_identities.create_index("guest_id", unique=True)
+    await get_db().guest_identities.create_index("last_seen_at")
+    await get_db().activity_daily.create_index([("user_id", 1), ("day", 1)], unique=True)
+    await get_db().activity_state.create_index("user_id", unique=True)
+    await get_db().focus_sessions.create_index([("user_id", 1), ("status", 1), ("created_at", -1)])
+    for collection, id_field, _ in SYNC_COLLECTIONS.values():
+        await get_db()[collection].create_index([("user_id", 1), ("updated_at", 1)])
+        # Import upserts match on (id, user_id)
+        await get_db()[collection].create_index([(id_field, 1), ("user_id", 1)])
+
+async def startup():
+    # Index creation and change stream discovery need Mongo round trips, so they
+    # run in the background instead of delaying the first request after a cold start
+    for coro in (create_indexes(), change_hub.start(), purge_abandoned_guests_periodically(),
+                 purge_unreferenced_snapshot_blobs_periodically(), backfill_body_storage()):
+        task = asyncio.create_task(coro)
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+async def shutdown():
+    await change_hub.stop()
+    for budget in link_prefetcher.users.values():
+        if budget.task:
+            budget.task.cancel()
+    for task in list(_background_tasks):
+        task.cancel()
+    if _http_client is not None:
+        await _http_client.aclose()
+    if _mongo_client is not None:
+        _mongo_client.close()
+
+def create_app() -> FastAPI:
+    """Build the FastAPI app; clients are created lazily on first use"""
+    app = FastAPI()
+    app.include_router(api_router)
+    
+    app.add_middleware(GuestIdentityMiddleware)
+    app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+    
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    
+    app.add_event_handler("startup", startup)
+    app.add_event_handler("shutdown", shutdown)
+    return app
+
+app = create_app()
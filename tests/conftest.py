@@ -0,0 +1,55 @@
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """The backend module wired to an in-memory Mongo and fresh per-process state"""
+    import server as module
+    from mongomock_motor import AsyncMongoMockClient
+
+    mongo = AsyncMongoMockClient()
+    monkeypatch.setattr(module, "_mongo_client", mongo)
+    monkeypatch.setattr(module, "_db", mongo["test"])
+    monkeypatch.setattr(module, "_http_client", None)
+    monkeypatch.setattr(module, "_origins", OrderedDict())
+    monkeypatch.setattr(module, "_settings_cache", OrderedDict())
+    monkeypatch.setattr(module, "_guest_touched", OrderedDict())
+    monkeypatch.setattr(module, "GUEST_ID_SECRET", "")
+    monkeypatch.setattr(module, "SNAPSHOT_DIR", tmp_path / "snapshots")
+    monkeypatch.setattr(module.llm_router, "providers", [])
+    monkeypatch.setattr(module, "link_prefetcher", module.LinkPrefetcher())
+    monkeypatch.setattr(module, "_proxy_cache", module.CompressedCache(module.PROXY_CACHE_ENTRIES, module.PROXY_CACHE_TTL))
+    monkeypatch.setattr(module, "_summary_cache", module.CompressedCache(module.SUMMARY_CACHE_ENTRIES, module.SUMMARY_CACHE_TTL))
+    return module
+
+
+@pytest.fixture
+def client(server):
+    from fastapi.testclient import TestClient
+
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def origin():
+    """Start local origin servers: origin(handle) -> OriginServer, where handle(request_handler) answers a GET or POST"""
+    from tests.helpers import OriginServer
+
+    servers = []
+
+    def start(handle):
+        server = OriginServer(handle)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
@@ -0,0 +1,87 @@
+def test_bootstrap_lists_previews_and_bodies_open_individually(client, server, monkeypatch):
+    body = "long body " * 2000  # past BODY_COMPRESS_MIN_SIZE, so stored compressed
+    note = client.post("/api/notes", json={"content": body}).json()
+    clip = client.post("/api/clips", json={"content": body, "url": "https://example.com"}).json()
+
+    inflated = []
+    unpack_body = server.unpack_body
+    monkeypatch.setattr(server, "unpack_body", lambda doc: inflated.append("content_z" in doc) or unpack_body(doc))
+    data = client.get("/api/bootstrap").json()
+    assert "content" not in data["notes"][0] and "content" not in data["clips"][0]
+    assert data["notes"][0]["preview"] == server.make_preview(body)
+    assert inflated and not any(inflated)
+
+    assert client.get(f"/api/notes/{note['note_id']}").json()["content"] == body
+    assert client.get(f"/api/clips/{clip['clip_id']}").json()["content"] == body
+    assert client.get("/api/clips/clip_missing").status_code == 404
+
+
+def test_clips_stored_before_updated_at_existed_still_list(client, server):
+    client.get("/api/notes")
+    user_id = client.cookies.get(server.GUEST_COOKIE).rsplit(".", 1)[0]
+    # Shaped the way clips were stored before previews and updated_at
+    legacy = {"clip_id": "clip_legacy", "user_id": user_id, "workspace_id": None, "content": "old clip",
+              "url": "https://example.com/old", "title": "Old", "tags": [], "created_at": "2024-01-02T03:04:05+00:00"}
+    client.portal.call(server.get_db().clips.insert_one, dict(legacy))
+
+    previews = client.get("/api/clips/previews")
+    assert previews.status_code == 200
+    assert previews.json()[0]["updated_at"] == previews.json()[0]["created_at"]
+    assert client.get("/api/bootstrap").json()["clips"][0]["clip_id"] == "clip_legacy"
+    assert client.get("/api/clips/clip_legacy").json()["updated_at"].startswith("2024-01-02T03:04:05")
+
+    client.portal.call(server.backfill_body_storage)
+    stored = client.portal.call(server.get_db().clips.find_one, {"clip_id": "clip_legacy"})
+    assert stored["updated_at"] == legacy["created_at"] and stored["preview"] == "old clip"
+
+
+def test_patch_applies_edits_and_rejects_stale_versions(client, server):
+    note = client.post("/api/notes", json={"content": "hello world"}).json()
+    url = f"/api/notes/{note['note_id']}"
+
+    patched = client.patch(url, json={"base_version": 0, "edits": [{"pos": 6, "delete": 5, "insert": "there"}]})
+    assert patched.status_code == 200 and patched.json()["version"] == 1
+    assert client.get(url).json()["content"] == "hello there"
+    assert client.get(url).json()["version"] == 1
+
+    # A second editor still on version 0 must not overwrite the first
+    stale = client.patch(url, json={"base_version": 0, "edits": [{"pos": 0, "delete": 5, "insert": "bye"}]})
+    assert stale.status_code == 409 and stale.json()["detail"]["version"] == 1
+    assert client.get(url).json()["content"] == "hello there"
+
+    assert client.patch(url, json={"base_version": 1, "edits": [{"pos": 0, "delete": 5, "insert": "hi"}], "title": "T"}).json()["version"] == 2
+    assert client.get(url).json()["content"] == "hi there"
+    assert client.patch(url, json={"base_version": 2, "edits": [{"pos": 50, "delete": 1}]}).status_code == 400
+    assert client.patch("/api/notes/note_missing", json={"base_version": 0}).status_code == 404
+
+
+def test_patch_losing_a_race_reports_this_users_version(client, server, monkeypatch):
+    note = client.post("/api/notes", json={"content": "hello"}).json()
+    # Another user's note with the same id must not leak into the conflict response
+    client.portal.call(server.get_db().notes.insert_one, {"note_id": note["note_id"], "user_id": "user_other", "content": "x", "version": 7})
+    db = server.get_db()
+
+    class RacingNotes:
+        """Lets another editor's write land between patch_note's read and its write"""
+        def __getattr__(self, name):
+            return getattr(db.notes, name)
+
+        async def update_one(self, query, update):
+            await db.notes.update_one({"note_id": query["note_id"], "user_id": query["user_id"]}, {"$inc": {"version": 1}})
+            return await db.notes.update_one(query, update)
+
+    class RacingDb:
+        notes = RacingNotes()
+
+        def __getattr__(self, name):
+            return getattr(db, name)
+
+        def __getitem__(self, name):
+            return db[name]
+    monkeypatch.setattr(server, "get_db", RacingDb)
+
+    lost = client.patch(f"/api/notes/{note['note_id']}", json={"base_version": 0, "edits": [{"pos": 0, "insert": "oh "}]})
+    assert lost.status_code == 409 and lost.json()["detail"]["version"] == 1
+    monkeypatch.setattr(server, "get_db", lambda: db)
+    stored = client.portal.call(server.get_db().notes.find_one, {"note_id": note["note_id"], "user_id": {"$ne": "user_other"}})
+    assert stored["content"] == "hello"
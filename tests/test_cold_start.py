@@ -0,0 +1,61 @@
+"""Cold-start budgets for the first request after a scale-from-zero.
+
+Each measurement runs in a fresh interpreter, so nothing is warm from other tests.
+"""
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+IMPORT_BUDGET = 1.0  # seconds to import server, dependencies included
+MODULE_BODY_BUDGET = 0.25  # seconds spent in server.py's own top level
+FIRST_RESPONSE_BUDGET = 0.5  # seconds from app startup to the first answered request
+DEFERRED_MODULES = ("openai", "motor", "pymongo", "httpx")
+
+COLD_START = """
+import json, sys, time
+started = time.perf_counter()
+import server
+imported = time.perf_counter()
+eager = [name for name in %r if name in sys.modules]
+from fastapi.testclient import TestClient
+ready = time.perf_counter()
+with TestClient(server.app) as client:
+    status = client.get("/api/").status_code
+    answered = time.perf_counter()
+print(json.dumps({"import": imported - started, "first_response": answered - ready, "eager": eager, "status": status}))
+""" % (DEFERRED_MODULES,)
+
+
+def run_python(*args: str) -> subprocess.CompletedProcess:
+    env = dict(
+        os.environ,
+        PYTHONPATH=str(BACKEND_DIR),
+        # Nothing listens here: the first request must not wait on Mongo
+        MONGO_URL="mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=200",
+    )
+    # Left unset as in the shipped .env, so the guest secret isn't loaded for /api/ either
+    env.pop("GUEST_ID_SECRET", None)
+    return subprocess.run([sys.executable, *args], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=60)
+
+
+def test_import_defers_heavy_clients_and_fits_the_budget():
+    result = run_python("-c", COLD_START)
+    assert result.returncode == 0, result.stderr
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    assert timings["eager"] == []
+    assert timings["import"] < IMPORT_BUDGET
+    assert timings["status"] == 200
+    assert timings["first_response"] < FIRST_RESPONSE_BUDGET
+
+
+def test_module_body_stays_cheap():
+    result = run_python("-X", "importtime", "-c", "import server")
+    assert result.returncode == 0, result.stderr
+    # Lines look like "import time:  self [us] | cumulative | name"
+    rows = [line.split("|") for line in result.stderr.splitlines() if line.startswith("import time:") and "|" in line]
+    self_us = {name.strip(): int(own.split(":")[1]) for own, _, name in rows if own.split(":")[1].strip().isdigit()}
+    assert self_us["server"] / 1e6 < MODULE_BODY_BUDGET
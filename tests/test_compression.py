@@ -0,0 +1,66 @@
+import brotli
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, deflate", "gzip"),
+    ("gzip;q=0, deflate", None),
+    ("x-gzip", None),
+    ("*", "gzip"),
+    ("*;q=0", None),
+    ("identity, *;q=0.5", "gzip"),
+    ("GZIP;Q=0.8", "gzip"),
+    ("", None),
+])
+def test_negotiate_encoding_honours_q_values(server, monkeypatch, header, expected):
+    monkeypatch.setattr(server, "brotli", None)
+    assert server.negotiate_encoding(header) == expected
+
+
+def test_brotli_wins_only_when_preferred(server):
+    assert server.negotiate_encoding("gzip, br") == "br"
+    assert server.negotiate_encoding("gzip;q=1, br;q=0.5") == "gzip"
+    assert server.negotiate_encoding("br;q=0, gzip") == "gzip"
+
+
+def test_refused_gzip_gets_an_identity_body(client):
+    for i in range(20):
+        client.post("/api/notes", json={"content": f"note {i} " * 20})
+    accepted = client.get("/api/notes", headers={"Accept-Encoding": "gzip"})
+    refused = client.get("/api/notes", headers={"Accept-Encoding": "gzip;q=0, identity"})
+    assert accepted.headers.get("content-encoding") == "gzip"
+    assert "content-encoding" not in refused.headers
+    assert refused.json() == accepted.json()
+
+
+def test_brotli_round_trips_through_the_middleware(client):
+    for i in range(20):
+        client.post("/api/notes", json={"content": f"note {i} " * 20})
+    plain = client.get("/api/notes", headers={"Accept-Encoding": "identity"})
+    # Ask httpx for the raw bytes so the test does the decoding, not the client
+    with client.stream("GET", "/api/notes", headers={"Accept-Encoding": "br, gzip"}) as compressed:
+        assert compressed.headers["content-encoding"] == "br"
+        assert "accept-encoding" in compressed.headers["vary"].lower()
+        raw = b"".join(compressed.iter_raw())
+    assert int(compressed.headers["content-length"]) == len(raw) < len(plain.content)
+    assert brotli.decompress(raw) == plain.content
+
+
+def test_streamed_responses_are_brotli_compressed_chunk_by_chunk(server):
+    chunks = [b"chunk %d " % i * 200 for i in range(5)]
+
+    async def stream(request):
+        async def body():
+            for chunk in chunks:
+                yield chunk
+        return StreamingResponse(body(), media_type="text/plain")
+    app = server.CompressionMiddleware(Starlette(routes=[Route("/", stream)]))
+
+    with TestClient(app).stream("GET", "/", headers={"Accept-Encoding": "br"}) as response:
+        assert response.headers["content-encoding"] == "br" and "content-length" not in response.headers
+        raw = b"".join(response.iter_raw())
+    assert brotli.decompress(raw) == b"".join(chunks)
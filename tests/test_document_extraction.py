@@ -0,0 +1,149 @@
+import os
+import time
+import tracemalloc
+import zlib
+
+import pytest
+
+from tests.helpers import respond
+
+
+def make_pdf(pages: int, image_kb: int) -> bytes:
+    """A paper-like PDF: one Flate text stream and one JPEG-sized image per page"""
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog, page_tree = add(None), add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    kids = []
+    for page in range(pages):
+        lines = [b"BT /F1 12 Tf 72 720 Td"]
+        for line in range(40):
+            lines.append(b"(Page %d line %d: asyncio event loops schedule coroutines \\(cooperatively\\).) Tj 0 -14 Td" % (page, line))
+        lines.append(b"[(Kerned) -300 (words) 50 (here)] TJ ET")
+        content = zlib.compress(b"\n".join(lines))
+        contents = add(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content) + content + b"\nendstream")
+        image = os.urandom(image_kb * 1024)
+        xobject = add(b"<< /Type /XObject /Subtype /Image /Width 64 /Height 64 /Length %d /Filter /DCTDecode >>\nstream\n" % len(image)
+                      + image + b"\nendstream")
+        kids.append(add(b"<< /Type /Page /Parent %d 0 R /Contents %d 0 R /Resources << /Font << /F1 %d 0 R >> /XObject << /Im1 %d 0 R >> >> >>"
+                        % (page_tree, contents, font, xobject)))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % page_tree
+    objects[page_tree - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+    info = add(b"<< /Title (Async Fixture Paper) >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, info, xref)
+    return bytes(out)
+
+
+def make_scan_pdf(image_bytes: int) -> bytes:
+    """A scanned-document PDF: one huge image stream ahead of a small text layer"""
+    image = os.urandom(image_bytes)
+    text = zlib.compress(b"BT /F1 12 Tf 72 720 Td (text layer after the scan) Tj ET")
+    return (b"%%PDF-1.4\n1 0 obj\n<< /Type /XObject /Subtype /Image /Length %d /Filter /DCTDecode >>\nstream\n" % len(image)
+            + image + b"\nendstream\nendobj\n2 0 obj\n<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(text)
+            + text + b"\nendstream\nendobj\n%%EOF\n")
+
+
+@pytest.fixture(scope="module")
+def paper():
+    return make_pdf(pages=400, image_kb=12)  # ~5 MB
+
+
+@pytest.fixture(scope="module")
+def scan():
+    return make_scan_pdf(15 * 1024 * 1024)
+
+
+@pytest.fixture
+def streaming_only(server, monkeypatch):
+    # With pypdf installed the extractor also keeps the raw file for a fallback
+    monkeypatch.setattr(server, "HAVE_PYPDF", False)
+    return server
+
+
+def measure(fn):
+    """Run fn; returns (result, seconds, peak traced bytes)"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = fn()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def feed_in_chunks(extractor, data: bytes, size: int = 16 * 1024):
+    view = memoryview(data)
+    for start in range(0, len(data), size):
+        extractor.feed(view[start:start + size])
+        if extractor.done:
+            break
+    return extractor.finish()
+
+
+def test_pdf_text_arrives_long_before_the_file_ends(client, streaming_only, origin, paper):
+    server = streaming_only
+
+    def handle(handler):
+        try:
+            respond(handler, paper, content_type="application/pdf")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the extractor stops reading once it has enough text
+    site = origin(handle)
+
+    url = f"{site.url}/paper.pdf"
+    async def download():
+        return (await server.get_http_client().get(url)).content
+    # Also warms up the shared client, so its setup isn't charged to the extractor
+    _, _, download_peak = measure(lambda: client.portal.call(download))
+
+    (kind, text, title), elapsed, peak = measure(lambda: client.portal.call(server.fetch_document, url, 8000))
+    assert len(paper) > 4 * 1024 * 1024
+    assert kind == "pdf"
+    assert text.startswith("Page 0 line 0: asyncio event loops schedule coroutines (cooperatively).")
+    assert "Kerned words" in text and len(text) >= 7900  # a -300 kern reads as a word gap
+    assert elapsed < 1.0
+    assert peak < len(paper) / 4 < download_peak / 4
+
+
+def test_pdf_image_streams_are_skipped_in_linear_time_and_constant_memory(streaming_only, scan):
+    text, elapsed, peak = measure(lambda: feed_in_chunks(streaming_only.PdfExtractor(8000), scan))
+    assert text == "text layer after the scan"
+    assert elapsed < 0.5
+    assert peak < 1024 * 1024
+
+
+def test_large_content_streams_are_scanned_in_linear_time(streaming_only):
+    # Content streams are buffered whole, but each chunk is searched once and the text
+    # operators are matched without backtracking over long runs
+    content = b"10 10 m 20 20 l S\n" * (400 * 1024) + b"(((([[[[" * 1024 + b"0" * 65536 + b"\nBT (last) Tj ET"
+    data = b"%%PDF-1.4\n1 0 obj\n<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream\nendobj\n"
+    started = time.perf_counter()
+    text = feed_in_chunks(streaming_only.PdfExtractor(8000), data)
+    assert text == "last"
+    assert time.perf_counter() - started < 2.0
+
+
+@pytest.mark.parametrize("extractor", ["TextExtractor", "MarkdownExtractor"])
+def test_bodies_without_newlines_stop_at_the_budget(server, extractor):
+    instance = getattr(server, extractor)(8000)
+    body = b"a" * (4 * 1024 * 1024)
+    text, _, peak = measure(lambda: feed_in_chunks(instance, body, size=64 * 1024))
+    assert instance.done and instance.pending == ""
+    assert text == "a" * 8000
+    assert peak < 1024 * 1024
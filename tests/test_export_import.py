@@ -0,0 +1,63 @@
+import gzip
+import tracemalloc
+import zlib
+
+import pytest
+
+
+async def chunked(data: bytes, size: int = 64 * 1024):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def test_gzip_export_round_trips_through_import(client):
+    client.post("/api/notes", json={"content": "exported note"})
+    client.post("/api/clips", json={"content": "exported clip", "url": "https://example.com"})
+
+    response = client.get("/api/export", params={"gzip": "true"}, headers={"Accept-Encoding": "identity"})
+    assert response.headers["content-encoding"] == "gzip"
+    archive = gzip.compress(response.content)  # httpx already inflated it; re-wrap as a .gz upload
+
+    client.cookies.clear()
+    result = client.post("/api/import", content=archive).json()
+    assert result["inserted"]["notes"] == 1 and result["inserted"]["clips"] == 1
+    assert [note["content"] for note in client.get("/api/notes").json()] == ["exported note"]
+
+
+def test_import_inflates_a_gzip_bomb_in_bounded_memory(client, server):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+    bomb = compressor.compress(b"x" * (256 * 1024 * 1024)) + compressor.flush()
+    assert len(bomb) < 1024 * 1024
+
+    tracemalloc.start()
+    try:
+        with pytest.raises(server.HTTPException) as raised:
+            client.portal.call(server.import_ndjson, "guest_bomb", chunked(bomb), True)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert raised.value.status_code == 413
+    assert peak < 2 * server.IMPORT_MAX_LINE + 8 * server.IMPORT_INFLATE_CHUNK
+
+
+def test_import_keeps_focus_session_links(client, server):
+    user_id = client.post("/api/notes", json={"content": "n"}).json()["user_id"]
+    session = server.FocusSession(
+        user_id=user_id,
+        topic={"keywords": [{"kw": "python", "w": 1.0}], "phrases": []},
+        local_matching_rules={}, synth_templates={}, confidence=0.9, recommendations={}
+    ).model_dump(mode="json")
+    client.portal.call(server.get_db().focus_sessions.insert_one, session)
+    client.post("/api/history", json={"url": "https://docs.python.org", "title": "python docs"})
+    client.post("/api/clips", json={"content": "clipped during the session"})
+    export = client.get("/api/export").content
+
+    client.cookies.clear()
+    client.post("/api/import", content=export)
+    new_user = client.get("/api/notes").json()[0]["user_id"]
+    db = server.get_db()
+    imported_session = client.portal.call(db.focus_sessions.find_one, {"user_id": new_user})
+    visit = client.portal.call(db.browsing_history.find_one, {"user_id": new_user})
+    clip = client.portal.call(db.clips.find_one, {"user_id": new_user})
+    assert visit["on_topic"] is True
+    assert visit["session_id"] == clip["session_id"] == imported_session["session_id"] != session["session_id"]
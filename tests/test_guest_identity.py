@@ -0,0 +1,26 @@
+def test_guest_cookie_survives_a_fresh_worker(client, server, monkeypatch):
+    client.post("/api/notes", json={"content": "kept"})
+    cookie = client.cookies.get(server.GUEST_COOKIE)
+    assert cookie
+
+    # A new worker or cold start begins without the secret and must load the same one from Mongo
+    monkeypatch.setattr(server, "GUEST_ID_SECRET", "")
+    notes = client.get("/api/notes").json()
+    assert [note["content"] for note in notes] == ["kept"]
+    assert client.cookies.get(server.GUEST_COOKIE) == cookie
+
+
+def test_configured_secret_takes_precedence(client, server, monkeypatch):
+    monkeypatch.setattr(server, "GUEST_ID_SECRET", "configured")
+    client.get("/api/notes")
+    guest_id, _ = client.cookies.get(server.GUEST_COOKIE).rsplit(".", 1)
+    assert client.portal.call(server.verify_guest_cookie, client.cookies.get(server.GUEST_COOKIE)) == guest_id
+    assert client.portal.call(server.get_db().app_config.find_one, {"_id": "guest_id_secret"}) is None
+
+
+def test_requests_without_a_guest_identity_never_load_the_secret(client, server, monkeypatch):
+    def unreachable():
+        raise RuntimeError("Mongo is down")
+    monkeypatch.setattr(server, "get_db", unreachable)
+    assert client.get("/api/").status_code == 200
+    assert server.GUEST_ID_SECRET == ""
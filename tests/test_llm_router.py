@@ -0,0 +1,142 @@
+import asyncio
+import itertools
+import json
+import time
+
+import pytest
+
+from tests.helpers import respond
+
+COMPLETION = json.dumps({
+    "id": "cmpl", "object": "chat.completion", "created": 0, "model": "fake",
+    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "ok"}}]
+}).encode()
+
+
+@pytest.fixture
+def fake_llm(origin):
+    """Start an OpenAI-compatible endpoint: fake_llm(slow_every, fail_every, offset) -> base URL.
+
+    Every slow_every-th request stalls for SLOW seconds and every fail_every-th
+    answers 500, so the injected tail is deterministic.
+    """
+    def start(slow_every: int = 0, fail_every: int = 0, offset: int = 0, slow: float = 0.6):
+        counter = itertools.count(offset)
+
+        def handle(handler):
+            handler.rfile.read(int(handler.headers["Content-Length"]))
+            n = next(counter)
+            if fail_every and n % fail_every == fail_every - 1:
+                respond(handler, b'{"error": {"message": "boom"}}', content_type="application/json", status=500)
+                return
+            time.sleep(slow if slow_every and n % slow_every == slow_every - 1 else 0.01)
+            respond(handler, COMPLETION, content_type="application/json")
+        return origin(handle).url + "/v1"
+    return start
+
+
+def latencies(router, count: int) -> list:
+    async def run():
+        timings = []
+        for _ in range(count):
+            started = time.monotonic()
+            assert await router.complete([{"role": "user", "content": "hi"}]) == "ok"
+            timings.append(time.monotonic() - started)
+        for provider in router.providers:
+            await provider.client.close()
+        return sorted(timings)
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def fast_hedging(server, monkeypatch):
+    monkeypatch.setattr(server, "LLM_HEDGE_MIN_SECONDS", 0.1)
+    monkeypatch.setattr(server, "LLM_HEDGE_DEFAULT_SECONDS", 0.1)
+    return server
+
+
+def test_hedging_cuts_the_latency_tail(fast_hedging, fake_llm):
+    server = fast_hedging
+    single = server.LLMRouter([server.LLMProvider("a", fake_llm(slow_every=20), "key", "fake")])
+    hedged = server.LLMRouter([
+        server.LLMProvider("a", fake_llm(slow_every=20), "key", "fake"),
+        server.LLMProvider("b", fake_llm(slow_every=20, offset=7), "key", "fake"),
+    ])
+
+    assert latencies(single, 40)[-1] >= 0.6  # the injected stalls reach the caller
+    hedged_timings = latencies(hedged, 40)
+    assert hedged_timings[-1] < 0.4  # ...but are hedged after ~0.1s
+    assert hedged_timings[len(hedged_timings) // 2] < 0.1
+
+
+def test_errors_fall_through_to_the_next_provider(fast_hedging, fake_llm):
+    server = fast_hedging
+    flaky = server.LLMProvider("flaky", fake_llm(fail_every=3), "key", "fake")
+    steady = server.LLMProvider("steady", fake_llm(), "key", "fake")
+    router = server.LLMRouter([flaky, steady])
+
+    timings = latencies(router, 30)
+    assert timings[-1] < 0.4  # a failure is retried elsewhere at once, not after a timeout
+    assert flaky.error_rate() > 0
+
+
+def test_breaker_stops_sending_to_a_failing_provider(fast_hedging, fake_llm, monkeypatch):
+    server = fast_hedging
+    monkeypatch.setattr(server, "LLM_BREAKER_COOLDOWN", 60)
+    broken = server.LLMProvider("broken", fake_llm(fail_every=1), "key", "fake")
+    router = server.LLMRouter([broken])
+
+    async def attempt():
+        try:
+            await router.complete([{"role": "user", "content": "hi"}])
+        except server.HTTPException as e:
+            return e.status_code
+
+    async def run():
+        statuses = [await attempt() for _ in range(server.LLM_BREAKER_FAILURES + 2)]
+        await broken.client.close()
+        return statuses
+    statuses = asyncio.run(run())
+    assert statuses == [502] * server.LLM_BREAKER_FAILURES + [503, 503]
+    assert broken.stats()["circuitOpen"] is True
+    assert len(broken.outcomes) == server.LLM_BREAKER_FAILURES  # nothing was sent once it opened
+
+
+def test_a_provider_that_turns_slow_loses_its_rank(fast_hedging, fake_llm):
+    server = fast_hedging
+    turned_slow = server.LLMProvider("a", fake_llm(slow_every=1, slow=1.0), "key", "fake")
+    # Its history says it is the fastest; from now on every response takes a second
+    turned_slow.latencies.extend([0.01] * 10)
+    turned_slow.outcomes.extend([True] * 10)
+    steady = server.LLMProvider("b", fake_llm(), "key", "fake")
+    router = server.LLMRouter([turned_slow, steady])
+
+    timings = latencies(router, 20)
+    # Each hedge it loses is recorded, so it stops being tried first after the first one
+    assert router.ranked()[0] is steady
+    assert turned_slow.p95() >= server.LLM_HEDGE_MIN_SECONDS
+    assert timings[-2] < 0.1
+
+
+def test_half_open_breaker_lets_a_single_probe_through(fast_hedging, fake_llm):
+    server = fast_hedging
+    recovered = server.LLMProvider("recovered", fake_llm(slow_every=1, slow=0.2), "key", "fake")
+    router = server.LLMRouter([recovered])
+    # Tripped earlier; the cooldown has just ended
+    recovered.consecutive_failures = server.LLM_BREAKER_FAILURES
+    recovered.open_until = time.monotonic() - 1
+
+    async def attempt():
+        try:
+            return await router.complete([{"role": "user", "content": "hi"}])
+        except server.HTTPException as e:
+            return e.status_code
+
+    async def run():
+        results = await asyncio.gather(*[attempt() for _ in range(4)])
+        await recovered.client.close()
+        return results
+    results = asyncio.run(run())
+    assert sorted(results, key=str) == [503, 503, 503, "ok"]
+    assert len(recovered.outcomes) == 1  # only the probe reached the provider
+    assert recovered.is_available() and recovered.open_until == 0.0
@@ -0,0 +1,137 @@
+import asyncio
+import socket
+import threading
+import time
+
+import httpx
+import pytest
+
+from tests.helpers import respond
+
+HEADERS = {"User-Agent": "test"}
+
+
+@pytest.fixture
+def refused_url():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()  # nothing listens here any more
+    return f"http://127.0.0.1:{port}/"
+
+
+def fetch(client, server, url, **kwargs):
+    return client.portal.call(lambda: server.fetch_page(url, HEADERS, **kwargs))
+
+
+def test_refused_connections_are_negatively_cached(client, server, refused_url, monkeypatch):
+    monkeypatch.setattr(server, "ORIGIN_NEGATIVE_TTL", 0.3)
+    with pytest.raises(httpx.ConnectError):
+        fetch(client, server, refused_url)
+
+    # Within the TTL the origin isn't contacted at all
+    started = time.monotonic()
+    with pytest.raises(server.OriginUnavailable) as cached:
+        fetch(client, server, refused_url + "other")
+    assert time.monotonic() - started < 0.05
+    assert cached.value.retry_after >= 1
+    response = client.get("/api/proxy", params={"url": refused_url})
+    assert response.status_code == 503 and response.headers["retry-after"]
+
+    time.sleep(0.35)
+    with pytest.raises(httpx.ConnectError):
+        fetch(client, server, refused_url)
+
+
+def test_breaker_opens_then_lets_a_single_probe_through(client, server, origin, monkeypatch):
+    monkeypatch.setattr(server, "ORIGIN_BREAKER_COOLDOWN", 0.3)
+    healthy = threading.Event()
+
+    def handle(handler):
+        handler.server.requests.append(handler.path)
+        if healthy.is_set():
+            time.sleep(0.2)  # keep the probe in flight while others arrive
+            respond(handler, b"ok")
+        else:
+            respond(handler, b"down", status=503)
+    site = origin(handle)
+
+    for _ in range(server.ORIGIN_BREAKER_FAILURES):
+        resp, _ = fetch(client, server, site.url + "/fail")
+        assert resp.status_code == 503
+    with pytest.raises(server.OriginUnavailable):
+        fetch(client, server, site.url + "/while-open")
+    assert "/while-open" not in site.requests
+    assert client.get("/api/origins/stats").json()["origins"][0]["circuitOpen"] is True
+
+    time.sleep(0.35)
+    healthy.set()
+
+    async def burst():
+        return await asyncio.gather(
+            *[server.fetch_page(f"{site.url}/half-open/{i}", HEADERS) for i in range(4)], return_exceptions=True
+        )
+    results = client.portal.call(burst)
+    probes = [result for result in results if not isinstance(result, Exception)]
+    assert len(probes) == 1 and probes[0][0].status_code == 200
+    assert all(isinstance(result, server.OriginUnavailable) for result in results if result not in probes)
+    assert len([path for path in site.requests if path.startswith("/half-open")]) == 1
+
+    # The successful probe closed the circuit
+    resp, _ = fetch(client, server, site.url + "/closed")
+    assert resp.status_code == 200
+
+
+def test_total_transfer_time_is_capped_for_slow_drip_servers(client, server, origin, monkeypatch):
+    monkeypatch.setattr(server, "FETCH_TOTAL_TIMEOUT", 0.5)
+
+    def handle(handler):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/html")
+        handler.end_headers()
+        try:
+            # Each byte arrives well within the read timeout, so only the total cap can stop it
+            for _ in range(100):
+                handler.wfile.write(b"x")
+                handler.wfile.flush()
+                time.sleep(0.05)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+    site = origin(handle)
+
+    started = time.monotonic()
+    with pytest.raises(httpx.ReadTimeout):
+        fetch(client, server, site.url + "/drip", raw=True)
+    assert time.monotonic() - started < 1.5
+    assert server.origin_health(site.url).consecutive_failures == 1
+
+
+def test_concurrent_requests_per_host_are_capped(client, server, origin, monkeypatch):
+    monkeypatch.setattr(server, "ORIGIN_MAX_CONCURRENCY", 2)
+    lock = threading.Lock()
+    active = [0]
+    peak = [0]
+
+    def handle(handler):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.15)
+        with lock:
+            active[0] -= 1
+        respond(handler, b"ok")
+    site = origin(handle)
+
+    async def burst(count):
+        return await asyncio.gather(
+            *[server.fetch_page(f"{site.url}/{i}", HEADERS) for i in range(count)], return_exceptions=True
+        )
+    results = client.portal.call(burst, 6)
+    assert all(resp.status_code == 200 for resp, _ in results)
+    assert peak[0] == 2
+
+    # Requests that can't get a slot within the connect timeout fail fast instead of queueing
+    monkeypatch.setattr(server, "FETCH_CONNECT_TIMEOUT", 0.05)
+    results = client.portal.call(burst, 4)
+    rejected = [result for result in results if isinstance(result, server.OriginUnavailable)]
+    assert len(rejected) == 2 and "Too many concurrent requests" in str(rejected[0])
@@ -0,0 +1,87 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from tests.helpers import respond, wait_until
+
+
+def index_page(section: str) -> bytes:
+    return (
+        f'<html><head><title>Index</title></head><body>'
+        f'<a href="/{section}/asyncio-guide">Asyncio event loop guide</a> '
+        f'<a href="/{section}/python/coroutines">Coroutines in Python</a> '
+        f'<a href="/{section}/cats">Funny cats</a>'
+        f'</body></html>'
+    ).encode()
+
+
+ARTICLE = b'<html><head><title>Article</title></head><body>' + b'<p>asyncio python coroutines</p>' * 2000 + b'</body></html>'
+
+
+@pytest.fixture
+def site(origin):
+    def handle(handler):
+        handler.server.requests.append(handler.path)
+        section, _, page = handler.path.strip("/").partition("/")
+        respond(handler, index_page(section) if page == "index" else ARTICLE)
+    return origin(handle)
+
+
+@pytest.fixture
+def reader_calls(server, monkeypatch):
+    calls = []
+
+    async def extract_reader_content(page_url, html_content=None):
+        calls.append(page_url)
+        return {"title": "Article", "content": "text", "summary": "summary"}, html_content
+    monkeypatch.setattr(server, "extract_reader_content", extract_reader_content)
+    return calls
+
+
+def focus(client, server):
+    """Opt the client's guest into prefetching and start a focus session on asyncio"""
+    client.put("/api/settings", json={"prefetch_links": True})
+    user_id = client.cookies.get(server.GUEST_COOKIE).rsplit(".", 1)[0]
+    client.portal.call(server.get_db().focus_sessions.insert_one, {
+        "session_id": "session_focus", "user_id": user_id, "status": "active",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "topic": {"keywords": [{"kw": "asyncio", "weight": 0.8}, {"kw": "python", "weight": 0.6},
+                               {"kw": "coroutines", "weight": 0.5}], "phrases": []},
+        "local_matching_rules": {}
+    })
+    return user_id
+
+
+def test_browsers_without_an_identity_are_not_minted_a_guest(client, server, site):
+    client.cookies.clear()
+    response = client.get("/api/proxy", params={"url": f"{site.url}/a/index"})
+    assert response.status_code == 200
+    assert server.GUEST_COOKIE not in response.cookies
+
+    assert not wait_until(lambda: len(site.requests) > 1, timeout=0.5)
+    db = server.get_db()
+    assert client.portal.call(db.user_settings.count_documents, {}) == 0
+    assert client.portal.call(db.guest_identities.count_documents, {}) == 0
+
+
+def test_prefetch_charges_bytes_as_sent_by_the_origin(client, server, site, reader_calls):
+    user_id = focus(client, server)
+    client.get("/api/proxy", params={"url": f"{site.url}/a/index"})
+    assert wait_until(lambda: server.link_prefetcher.stats["prefetched"] == 2)
+
+    budget = server.link_prefetcher.users[user_id]
+    assert sorted(site.requests) == ["/a/asyncio-guide", "/a/index", "/a/python/coroutines"]
+    # Both articles arrived uncompressed; the cache keeps them gzipped at a fraction of that
+    assert sum(size for _, size in budget.transfers) == 2 * len(ARTICLE)
+    assert len(server._proxy_cache.get(f"{site.url}/a/asyncio-guide")[0]) < len(ARTICLE) / 10
+
+
+def test_reader_warmups_are_capped_per_hour(client, server, site, reader_calls, monkeypatch):
+    monkeypatch.setattr(server, "PREFETCH_READER_PER_HOUR", 1)
+    focus(client, server)
+    client.get("/api/proxy", params={"url": f"{site.url}/a/index"})
+    assert wait_until(lambda: server.link_prefetcher.stats["readerWarmed"] == 1)
+
+    client.get("/api/proxy", params={"url": f"{site.url}/b/index"})
+    assert wait_until(lambda: server.link_prefetcher.stats["readerOverBudget"] == 1)
+    assert len(reader_calls) == 1
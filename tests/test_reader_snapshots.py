@@ -0,0 +1,73 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from tests.helpers import wait_until
+
+
+def fake_extract(calls):
+    async def extract_reader_content(page_url, html_content=None):
+        calls.append(page_url)
+        return {"title": "Page", "content": f"<p>{page_url} body</p>", "summary": ""}, "<html></html>"
+    return extract_reader_content
+
+
+def test_reader_mode_survives_an_unwritable_snapshot_store(client, server, monkeypatch, tmp_path):
+    blocked = tmp_path / "read-only"
+    blocked.write_text("not a directory")
+    monkeypatch.setattr(server, "SNAPSHOT_DIR", blocked)
+    calls = []
+    monkeypatch.setattr(server, "extract_reader_content", fake_extract(calls))
+
+    response = client.post("/api/reader_mode", json={"url": "https://example.com/a"})
+    assert response.status_code == 200
+    assert response.json()["title"] == "Page"
+    assert client.portal.call(server.get_db().reader_snapshots.count_documents, {}) == 0
+
+
+def test_unreferenced_blobs_are_swept_after_the_grace_period(client, server, monkeypatch):
+    monkeypatch.setattr(server, "extract_reader_content", fake_extract([]))
+    client.post("/api/reader_mode", json={"url": "https://example.com/a"})
+    client.post("/api/reader_mode", json={"url": "https://example.com/b"})
+    before_refresh = set(server.SNAPSHOT_DIR.glob("*/*.gz"))
+
+    # A refresh with new content leaves the old content blob of /a behind
+    async def changed_content(page_url, html_content=None):
+        return {"title": "Page", "content": "changed", "summary": ""}, "<html></html>"
+    monkeypatch.setattr(server, "extract_reader_content", changed_content)
+    client.post("/api/reader_mode", json={"url": "https://example.com/a", "refresh": True})
+    abandoned_tmp = server.SNAPSHOT_DIR / "ab" / "ab12.1234abcd.tmp"
+    abandoned_tmp.parent.mkdir(parents=True, exist_ok=True)
+    abandoned_tmp.write_bytes(b"partial")
+
+    files = set(server.SNAPSHOT_DIR.glob("*/*"))
+    assert client.portal.call(server.purge_unreferenced_snapshot_blobs) == 0  # still within the grace period
+
+    past = time.time() - server.SNAPSHOT_GC_GRACE - 1
+    for path in files:
+        os.utime(path, (past, past))
+    assert client.portal.call(server.purge_unreferenced_snapshot_blobs) == 2
+    remaining = set(server.SNAPSHOT_DIR.glob("*/*"))
+    assert files - remaining == {abandoned_tmp} | (before_refresh - remaining)
+    assert len(before_refresh - remaining) == 1  # the replaced content blob of /a
+
+    for url in ("https://example.com/a", "https://example.com/b"):
+        assert client.post("/api/reader_mode", json={"url": url}).json()["title"] == "Page"
+
+
+def test_bookmarks_only_refresh_missing_or_stale_snapshots(client, server, monkeypatch):
+    calls = []
+    monkeypatch.setattr(server, "extract_reader_content", fake_extract(calls))
+    bookmark = {"url": "https://example.com/paper", "title": "Paper"}
+
+    client.post("/api/bookmarks", json=bookmark)
+    assert wait_until(lambda: client.portal.call(server.get_db().reader_snapshots.count_documents, {}) == 1)
+    # Bookmarking a page that already has a fresh snapshot fetches nothing
+    client.post("/api/bookmarks", json=bookmark)
+    client.post("/api/bookmarks", json=bookmark)
+    assert calls == ["https://example.com/paper"]
+
+    stale = (datetime.now(timezone.utc) - server.SNAPSHOT_REFRESH_AFTER - timedelta(minutes=1)).isoformat()
+    client.portal.call(server.get_db().reader_snapshots.update_many, {}, {"$set": {"fetched_at": stale}})
+    client.post("/api/bookmarks", json=bookmark)
+    assert wait_until(lambda: len(calls) == 2)
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta, timezone
+
+
+def test_sync_cursor_survives_an_unencoded_query_string(client):
+    cursor = client.get("/api/bootstrap").json()["cursor"]
+    assert cursor.endswith("Z") and "+" not in cursor
+
+    response = client.get(f"/api/sync?since={cursor}")
+    assert response.status_code == 200
+    # Cursors issued before the Z suffix arrive with their + decoded to a space
+    legacy = cursor.replace("Z", "+00:00")
+    assert client.get(f"/api/sync?since={legacy}").status_code == 200
+
+
+def test_sync_pages_through_more_changes_than_fit(client, server, monkeypatch):
+    monkeypatch.setattr(server, "SYNC_PAGE_SIZE", 3)
+    cursor = client.get("/api/bootstrap").json()["cursor"]
+    note_ids = [client.post("/api/notes", json={"content": f"note {i}"}).json()["note_id"] for i in range(7)]
+
+    # Spread the notes out after the cursor, with two sharing a timestamp across the first page boundary
+    base = datetime.fromisoformat(cursor) + timedelta(milliseconds=1)
+    offsets = [0, 1, 2, 2, 3, 4, 5]
+    for note_id, offset in zip(note_ids, offsets):
+        stamp = (base + timedelta(milliseconds=offset)).astimezone(timezone.utc).isoformat()
+        client.portal.call(server.get_db().notes.update_one, {"note_id": note_id}, {"$set": {"updated_at": stamp}})
+
+    seen = []
+    for _ in range(5):
+        page = client.get("/api/sync", params={"since": cursor}).json()
+        seen.extend(note["note_id"] for note in page["changes"]["notes"])
+        cursor = page["cursor"]
+        if not page["has_more"]:
+            break
+    assert not page["has_more"]
+    assert set(seen) == set(note_ids)
+    # The first page stops before the shared timestamp instead of splitting it
+    assert seen[:2] == note_ids[:2]
+
+
+def test_sync_falls_back_to_full_resync_when_a_page_cannot_be_split(client, server, monkeypatch):
+    monkeypatch.setattr(server, "SYNC_PAGE_SIZE", 2)
+    cursor = client.get("/api/bootstrap").json()["cursor"]
+    stamp = (datetime.fromisoformat(cursor) + timedelta(seconds=1)).isoformat()
+    for i in range(3):
+        note_id = client.post("/api/notes", json={"content": f"note {i}"}).json()["note_id"]
+        client.portal.call(server.get_db().notes.update_one, {"note_id": note_id}, {"$set": {"updated_at": stamp}})
+
+    assert client.get("/api/sync", params={"since": cursor}).json()["full_resync"] is True
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta, timezone
+
+from tests.helpers import wait_until
+
+
+def guest_id(client, server) -> str:
+    client.get("/api/notes")  # mints the guest cookie the socket handshake carries
+    return client.cookies.get(server.GUEST_COOKIE).rsplit(".", 1)[0]
+
+
+def test_changes_reach_the_users_socket(client, server):
+    user_id = guest_id(client, server)
+    with client.websocket_connect("/api/ws") as ws:
+        assert wait_until(lambda: user_id in server.change_hub.subscribers)
+        note = client.post("/api/notes", json={"content": "pushed"}).json()
+        message = ws.receive_json()
+        assert message["type"] == "change" and message["collection"] == "notes"
+        assert message["op"] == "upsert" and message["id"] == note["note_id"]
+        assert message["doc"]["content"] == "pushed"
+
+        client.delete(f"/api/notes/{note['note_id']}")
+        assert ws.receive_json() == {"type": "change", "collection": "notes", "op": "delete", "id": note["note_id"], "doc": None}
+
+
+def test_a_socket_that_falls_behind_is_asked_to_resync(client, server):
+    user_id = guest_id(client, server)
+    with client.websocket_connect("/api/ws") as ws:
+        assert wait_until(lambda: user_id in server.change_hub.subscribers)
+
+        async def burst():
+            # Without yielding to the socket's sender, so its queue overflows
+            for i in range(server.WS_QUEUE_SIZE + 1):
+                server.change_hub.publish("notes", "upsert", user_id, f"note_{i}", {"content": str(i)})
+        client.portal.call(burst)
+        assert ws.receive_json() == {"type": "resync"}
+
+        client.post("/api/notes", json={"content": "after"})
+        assert ws.receive_json()["doc"]["content"] == "after"  # the backlog was dropped
+
+
+def test_closing_the_socket_unsubscribes_it(client, server):
+    user_id = guest_id(client, server)
+    with client.websocket_connect("/api/ws"):
+        assert wait_until(lambda: user_id in server.change_hub.subscribers)
+    assert wait_until(lambda: user_id not in server.change_hub.subscribers)
+    # Publishing to a user with no sockets is a no-op
+    client.post("/api/notes", json={"content": "nobody listening"})
+    assert user_id not in server.change_hub.subscribers
+
+
+def test_session_tokens_are_taken_from_headers_not_the_url(client, server):
+    user_id = guest_id(client, server)
+    db = server.get_db()
+    client.portal.call(db.users.insert_one, {"user_id": "user_1", "email": "a@example.com", "name": "A",
+                                             "created_at": datetime.now(timezone.utc).isoformat()})
+    client.portal.call(db.user_sessions.insert_one, {"user_id": "user_1", "session_token": "secret-token",
+                                                     "expires_at": datetime.now(timezone.utc) + timedelta(days=1)})
+
+    with client.websocket_connect("/api/ws?token=secret-token"):
+        # Not looked up as a session: the socket belongs to the cookie's guest
+        assert wait_until(lambda: user_id in server.change_hub.subscribers)
+        assert "user_1" not in server.change_hub.subscribers
+    with client.websocket_connect("/api/ws", headers={"Authorization": "Bearer secret-token"}):
+        assert wait_until(lambda: "user_1" in server.change_hub.subscribers)